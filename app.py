@@ -4,46 +4,270 @@ import os
 import logging
 import uuid
 import hashlib
+import base64
+import gzip
+import zlib
 import traceback
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+import threading
+import time
+import math
+import random
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import click
+from flask import Flask, Response, request, jsonify, render_template, session, redirect, url_for, stream_with_context, has_request_context
 from flask_cors import CORS
 from functools import wraps
-from supabase import create_client
 from dotenv import load_dotenv
+from http_clients import openrouter_client, serpapi_client
+from cache import MISSING, ConversationCache, KeyedLocks, SearchCache, TTLCache, normalize_query, request_cache_key
+from query_intent import gate_from_env, is_small_talk
+from model_router import router_from_env
+from session_store import session_interface_from_env
+from prompt_builder import PromptBuilder
+from text_processing import ResponseFormatter, extract_user_info, postprocess_response
+from persistence import WriteBehindQueue, private_state_dir
+from summarizer import ConversationCompactor, parse_timestamp
+from metrics import registry
+from rate_limit import AdmissionError, UpstreamLimiter, UserRateLimiter, parse_retry_after
+from singleflight import SingleFlight
+import http_clients
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(24))
+# Server-side sessions unless SESSION_BACKEND=cookie; see session_store.py
+session_interface = session_interface_from_env()
+if session_interface is not None:
+    app.session_interface = session_interface
 CORS(app, supports_credentials=True)
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 
-# Initialize Supabase client
-try:
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    
-    if not supabase_url or not supabase_key:
-        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env file")
-    
-    app.logger.info("Initializing Supabase client...")
-    app.logger.debug(f"Supabase URL: {supabase_url}")
-    app.logger.debug(f"Supabase key (first 10 chars): {supabase_key[:10]}...")
-    
-    supabase = create_client(supabase_url, supabase_key)
-    
-    # Test the connection
-    app.logger.info("Testing Supabase connection...")
-    test_query = supabase.table('users').select("count").execute()
-    app.logger.info("Supabase connection successful!")
-except Exception as e:
-    app.logger.error(f"Failed to initialize Supabase: {str(e)}")
-    app.logger.error(traceback.format_exc())
-    raise
+# Shared pool for the independent network calls of a chat turn
+io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('CHAT_IO_WORKERS', '8')),
+    thread_name_prefix='chat-io'
+)
+
+# Most previous turns considered for the prompt; the token budget may send fewer
+HISTORY_LIMIT = int(os.getenv('PROMPT_MAX_HISTORY_TURNS', '10'))
+
+# Search results stored with a user turn are kept this long, for auditing
+CONTEXT_TTL = int(os.getenv('CONTEXT_TTL', str(7 * 24 * 3600)))
+CONTEXT_PURGE_INTERVAL = int(os.getenv('CONTEXT_PURGE_INTERVAL', '3600'))
+
+# Queue conversation inserts and write them in batches off the request path.
+# Off by default on Vercel, which freezes the instance once the response is
+# sent and discards its /tmp journals
+PERSIST_WRITE_BEHIND = os.getenv('PERSIST_WRITE_BEHIND', '0' if os.getenv('VERCEL') else '1') == '1'
+
+prompt_builder = PromptBuilder(
+    token_budget=int(os.getenv('PROMPT_TOKEN_BUDGET', '3000')),
+    max_history_turns=HISTORY_LIMIT,
+    memory_budget=int(os.getenv('PROMPT_MEMORY_BUDGET', '500'))
+)
+
+# Past exchanges are indexed locally and the most relevant are recalled
+# into the prompt; MEMORY_DIR should be shared by the workers of a host
+MEMORY_ENABLED = os.getenv('MEMORY_ENABLED', '1') == '1'
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', '3'))
+
+# Recent turns per user, written through by save_message. Turns saved by
+# other workers only show up once an entry expires, so with several
+# workers HISTORY_CACHE_TTL bounds how long a prompt can miss them
+history_cache = ConversationCache(
+    turns_per_user=int(os.getenv('HISTORY_CACHE_TURNS', str(HISTORY_LIMIT))),
+    max_users=int(os.getenv('HISTORY_CACHE_USERS', '1000')),
+    max_chars=int(os.getenv('HISTORY_CACHE_MAX_CHARS', '8000000')),
+    ttl=int(os.getenv('HISTORY_CACHE_TTL', '60'))
+)
+
+# Parsed user_info profiles; they change rarely, so they are read from here
+profile_cache = TTLCache(
+    max_entries=int(os.getenv('PROFILE_CACHE_SIZE', '10000')),
+    ttl=int(os.getenv('PROFILE_CACHE_TTL', '600'))
+)
+# Serializes read-merge-upsert per user within this process
+profile_locks = KeyedLocks()
+# Rolling summaries of compacted history, filled alongside the profile
+summary_cache = TTLCache(
+    max_entries=int(os.getenv('PROFILE_CACHE_SIZE', '10000')),
+    ttl=int(os.getenv('PROFILE_CACHE_TTL', '600'))
+)
+
+# Page sizes for /history
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '20'))
+HISTORY_PAGE_MAX = int(os.getenv('HISTORY_PAGE_MAX', '100'))
+
+# Responses smaller than this are not worth gzipping
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '500'))
+
+# Turns beyond the newest SUMMARY_KEEP_TURNS are folded into a per-user
+# summary and archived by a background compactor
+SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', '1') == '1'
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '300'))
+
+# Search results by normalized query; set SEARCH_CACHE_PATH to persist them
+search_cache = SearchCache(
+    max_entries=int(os.getenv('SEARCH_CACHE_SIZE', '5000')),
+    ttl=int(os.getenv('SEARCH_CACHE_TTL', '3600')),
+    negative_ttl=int(os.getenv('SEARCH_CACHE_NEGATIVE_TTL', '300')),
+    path=os.getenv('SEARCH_CACHE_PATH')
+)
+
+# Decides which messages are worth a web search
+search_gate = gate_from_env()
+
+# Identical searches in flight at the same time share one SerpAPI call;
+# SEARCH_COALESCE_KEY=exact only merges byte-identical queries
+SEARCH_COALESCE_KEYS = {'normalized': normalize_query, 'exact': None}
+search_flight = SingleFlight(
+    normalize=SEARCH_COALESCE_KEYS[os.getenv('SEARCH_COALESCE_KEY', 'normalized')],
+    max_wait=float(os.getenv('SEARCH_COALESCE_MAX_WAIT', '10'))
+)
+
+# Formatted replies to non-personalized prompts, keyed by request hash
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1') == '1'
+reply_cache = TTLCache(
+    max_entries=int(os.getenv('LLM_CACHE_SIZE', '2000')),
+    ttl=int(os.getenv('LLM_CACHE_TTL', '300'))
+)
+
+# Identical non-personalized completions in flight share one upstream call
+LLM_COALESCE_ENABLED = os.getenv('LLM_COALESCE_ENABLED', '1') == '1'
+llm_flight = SingleFlight(max_wait=float(os.getenv('LLM_COALESCE_MAX_WAIT', '20')))
+
+# Chat turns per user: a sustained rate with room for short bursts;
+# USER_RATE_PER_MINUTE=0 disables the per-user limit
+USER_RATE_PER_MINUTE = float(os.getenv('USER_RATE_PER_MINUTE', '20'))
+user_limiter = UserRateLimiter(
+    rate=USER_RATE_PER_MINUTE / 60,
+    burst=int(os.getenv('USER_RATE_BURST', '5')),
+    max_users=int(os.getenv('USER_RATE_MAX_USERS', '10000'))
+) if USER_RATE_PER_MINUTE > 0 else None
+
+# Concurrent upstream calls per process; callers queue up to UPSTREAM_MAX_WAIT
+UPSTREAM_MAX_WAIT = float(os.getenv('UPSTREAM_MAX_WAIT', '5'))
+openrouter_limiter = UpstreamLimiter(
+    'OpenRouter',
+    max_concurrent=int(os.getenv('OPENROUTER_MAX_CONCURRENCY', '8')),
+    max_wait=UPSTREAM_MAX_WAIT
+)
+serpapi_limiter = UpstreamLimiter(
+    'SerpAPI',
+    max_concurrent=int(os.getenv('SERPAPI_MAX_CONCURRENCY', '4')),
+    max_wait=UPSTREAM_MAX_WAIT
+)
+
+# Models to route completions across; see model_router for the MODEL_* settings
+DEFAULT_MODEL = "x-ai/grok-4-fast:free"
+model_router = router_from_env(DEFAULT_MODEL, no_fallback=(AdmissionError,))
+MAX_TOKENS = int(os.getenv('MODEL_MAX_TOKENS', '500'))
+# Greetings and pleasantries get a smaller completion budget
+SHORT_QUERY_MAX_TOKENS = int(os.getenv('SHORT_QUERY_MAX_TOKENS', '200'))
+
+# Fraction of chat turns whose stage timings are logged as a trace
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+
+STAGE_SECONDS = registry.histogram('chatbot_stage_seconds', 'Duration of each chat pipeline stage')
+TURN_SECONDS = registry.histogram('chatbot_turn_seconds', 'End-to-end duration of successful chat turns')
+CHAT_TURNS = registry.counter('chatbot_chat_turns_total', 'Chat turns by route and outcome')
+
+# Heavy clients are created on first use rather than at import, so cold
+# starts (every new Vercel instance, every gunicorn worker) serve sooner
+_supabase = None
+_clients_lock = threading.Lock()
+
+def get_supabase():
+    """Return the Supabase client, creating it on first use."""
+    global _supabase
+    if _supabase is None:
+        with _clients_lock:
+            if _supabase is None:
+                supabase_url = os.getenv('SUPABASE_URL')
+                supabase_key = os.getenv('SUPABASE_KEY')
+                
+                if not supabase_url or not supabase_key:
+                    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+                
+                # Deferred: importing supabase costs more than the rest of the app
+                from supabase import create_client
+                
+                app.logger.info("Initializing Supabase client...")
+                app.logger.debug(f"Supabase URL: {supabase_url}")
+                _supabase = create_client(supabase_url, supabase_key)
+    return _supabase
+
+_conversation_writer = None
+
+def get_conversation_writer():
+    """Return the write-behind queue for conversation rows, or None if disabled."""
+    global _conversation_writer
+    if _conversation_writer is None and PERSIST_WRITE_BEHIND:
+        with _clients_lock:
+            if _conversation_writer is None:
+                _conversation_writer = WriteBehindQueue(
+                    insert_conversation_rows,
+                    name='conversations',
+                    max_queue=int(os.getenv('PERSIST_QUEUE_SIZE', '10000')),
+                    batch_size=int(os.getenv('PERSIST_BATCH_SIZE', '50')),
+                    flush_interval=float(os.getenv('PERSIST_FLUSH_INTERVAL', '0.2')),
+                    retries=int(os.getenv('PERSIST_RETRIES', '3')),
+                    journal_dir=os.getenv('PERSIST_JOURNAL_DIR') or private_state_dir()
+                )
+    return _conversation_writer
+
+_memory = None
+
+def get_memory():
+    """Return the retrieval memory, or None if it is disabled or unavailable."""
+    global _memory, MEMORY_ENABLED
+    if _memory is None and MEMORY_ENABLED:
+        with _clients_lock:
+            if _memory is None and MEMORY_ENABLED:
+                try:
+                    # Deferred: numpy is only needed once someone chats
+                    from retrieval_memory import RetrievalMemory
+                except ImportError as e:
+                    app.logger.warning(f"Retrieval memory disabled: {str(e)}")
+                    MEMORY_ENABLED = False
+                    return None
+                _memory = RetrievalMemory(
+                    os.getenv('MEMORY_DIR') or os.path.join(private_state_dir(), 'memory'),
+                    dim=int(os.getenv('MEMORY_DIM', '1024')),
+                    max_rows=int(os.getenv('MEMORY_MAX_ROWS', '5000')),
+                    # Exchanges still in the prompt's history are not recalled
+                    exclude_recent=HISTORY_LIMIT // 2,
+                    min_score=float(os.getenv('MEMORY_MIN_SCORE', '0.15')),
+                    max_chars=int(os.getenv('MEMORY_MAX_CHARS', '600'))
+                )
+    return _memory
+
+_compactor = None
+
+def get_compactor():
+    """Return the history compactor, or None if summarization is disabled."""
+    global _compactor
+    if _compactor is None and SUMMARY_ENABLED:
+        with _clients_lock:
+            if _compactor is None:
+                _compactor = ConversationCompactor(
+                    get_supabase,
+                    summarize_history,
+                    keep_turns=int(os.getenv('SUMMARY_KEEP_TURNS', str(HISTORY_LIMIT))),
+                    min_turns=int(os.getenv('SUMMARY_MIN_TURNS', '10')),
+                    batch_size=int(os.getenv('SUMMARY_BATCH_SIZE', '200')),
+                    archive=os.getenv('SUMMARY_ARCHIVE', '1') == '1',
+                    interval=int(os.getenv('SUMMARY_INTERVAL', '300')),
+                    on_summary=summary_cache.set
+                )
+    return _compactor
 
 def hash_password(password):
     """Create a secure hash of the password."""
@@ -75,7 +299,7 @@ def register():
         
         try:
             # Check if username exists
-            result = supabase.table('users').select('id').eq('username', username).execute()
+            result = get_supabase().table('users').select('id').eq('username', username).execute()
             if result.data:
                 return render_template('register.html', error="Username already exists")
             
@@ -98,7 +322,7 @@ def register():
             # Insert new user with RLS bypass
             app.logger.info("Inserting new user into database...")
             try:
-                result = supabase.table('users').insert(user_data).execute()
+                result = get_supabase().table('users').insert(user_data).execute()
                 
                 if not result.data:
                     app.logger.error("User creation failed: No data returned")
@@ -109,7 +333,7 @@ def register():
                 if "new row violates row-level security policy" in error_str:
                     # If this error occurs, we need to use the auth API instead
                     try:
-                        auth_response = supabase.auth.sign_up({
+                        auth_response = get_supabase().auth.sign_up({
                             "email": f"{username}@temp.com",
                             "password": password,
                             "data": {
@@ -118,7 +342,7 @@ def register():
                             }
                         })
                         if auth_response.user and auth_response.user.id:
-                            result = supabase.table('users').insert({
+                            result = get_supabase().table('users').insert({
                                 'id': auth_response.user.id,
                                 'username': username,
                                 'password_hash': hashed_password
@@ -135,10 +359,11 @@ def register():
             
             # Initialize user_info
             app.logger.info("Initializing user_info...")
-            supabase.table('user_info').insert({
+            get_supabase().table('user_info').insert({
                 'user_id': str(user_id),
                 'info': json.dumps({})
             }).execute()
+            profile_cache.set(str(user_id), {})
             
             app.logger.info("User registration complete. Redirecting to home...")
             return redirect(url_for('home'))
@@ -164,7 +389,7 @@ def login():
             return render_template('login.html', error="Please fill in all fields")
         
         try:
-            result = supabase.table('users').select('id, password_hash').eq('username', username).execute()
+            result = get_supabase().table('users').select('id, password_hash').eq('username', username).execute()
             
             if result.data and result.data[0]['password_hash'] == hash_password(password):
                 session.clear()
@@ -182,138 +407,656 @@ def login():
 
 @app.route('/logout')
 def logout():
+    if 'user_id' in session:
+        invalidate_user_info(session['user_id'])
     session.clear()
     return redirect(url_for('login'))
 
+@app.route('/healthz')
+def healthz():
+    """Check that the app is up and Supabase answers a trivial query."""
+    start = time.perf_counter()
+    try:
+        get_supabase().table('users').select('id').limit(1).execute()
+    except Exception as e:
+        app.logger.error(f"Health check failed: {str(e)}")
+        return jsonify({"status": "error", "supabase": str(e)}), 503
+    return jsonify({
+        "status": "ok",
+        "supabase": "ok",
+        "supabase_ms": round((time.perf_counter() - start) * 1000, 1)
+    })
+
 @app.route('/')
 def home():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     return render_template('index.html', username=session.get('username', ''))
 
-def extract_user_info(message):
-    """Extract potential user information from the message."""
-    info = {}
-    import re
-    name_patterns = [
-        r"(?i)my name is (\w+)",
-        r"(?i)i am (\w+)",
-        r"(?i)i'm (\w+)",
-        r"(?i)call me (\w+)"
-    ]
-    
-    for pattern in name_patterns:
-        match = re.search(pattern, message)
-        if match:
-            info['name'] = match.group(1)
-            break
-    
-    return info
+def load_user_info(user_id):
+    """Read the stored profile for a user, raising on database errors."""
+    info = profile_cache.get(user_id)
+    if info is MISSING:
+        result = get_supabase().table('user_info').select('info', 'summary').eq('user_id', user_id).execute()
+        info = json.loads(result.data[0]['info']) if result.data else {}
+        profile_cache.set(user_id, info)
+        summary_cache.set(user_id, result.data[0].get('summary') if result.data else None)
+    return dict(info)
 
 def save_user_info(user_id, new_info):
-    """Save or update user information in Supabase."""
+    """Merge new information into the stored profile with a single upsert."""
     try:
-        result = supabase.table('user_info').select('info').eq('user_id', user_id).execute()
-        
-        if result.data:
-            current_info = json.loads(result.data[0]['info'])
-            current_info.update(new_info)
-            supabase.table('user_info').update({'info': json.dumps(current_info)}).eq('user_id', user_id).execute()
-        else:
-            supabase.table('user_info').insert({
+        with profile_locks(user_id):
+            current_info = load_user_info(user_id)
+            merged_info = {**current_info, **new_info}
+            if merged_info == current_info:
+                return
+            get_supabase().table('user_info').upsert({
                 'user_id': user_id,
-                'info': json.dumps(new_info)
-            }).execute()
+                'info': json.dumps(merged_info)
+            }, on_conflict='user_id').execute()
+            profile_cache.set(user_id, merged_info)
     except Exception as e:
         app.logger.error(f"Error saving user info: {str(e)}")
+        invalidate_user_info(user_id)
         raise
 
 def get_user_info(user_id):
-    """Get user information from Supabase."""
+    """Get user information, from the profile cache when fresh."""
     try:
-        result = supabase.table('user_info').select('info').eq('user_id', user_id).execute()
-        return json.loads(result.data[0]['info']) if result.data else {}
+        return load_user_info(user_id)
     except Exception as e:
         app.logger.error(f"Error getting user info: {str(e)}")
         return {}
 
-def get_conversation_history(user_id, limit=20):
-    """Get recent conversation history for a user."""
+def invalidate_user_info(user_id):
+    """Drop a cached profile so the next read goes to Supabase."""
+    profile_cache.invalidate(user_id)
+    summary_cache.invalidate(user_id)
+
+def get_history_summary(user_id):
+    """Get the rolling summary of a user's compacted history, or None."""
+    summary = summary_cache.get(user_id)
+    if summary is not MISSING:
+        return summary
     try:
-        result = supabase.table('conversations').select('role', 'content').eq('user_id', user_id).order('timestamp', desc=True).limit(limit).execute()
-        messages = result.data
-        
-        system_message = {
-            "role": "system",
-            "content": """You are a helpful, friendly assistant that remembers information about the user throughout the conversation.
-
-            Important instructions for formatting responses:
-            1. Always structure your responses in a clean, easy-to-read format
-            2. Use bullet points (•) or numbered lists when listing multiple items
-            3. Use appropriate spacing and line breaks for readability
-            4. For data or statistics, present them in a clear, structured way
-            5. Use appropriate emphasis with bold or italics markers when needed
-            6. When sharing weather or time-sensitive information, highlight the key details
-            7. Break down complex information into digestible sections
-            
-            Important instructions for personalization:
-            1. Remember and use the user's name if they share it
-            2. Remember personal preferences and context from previous conversations
-            3. If providing real-time data (weather, news, etc.), highlight the most relevant information first
-            4. If you need to correct or clarify something, do so politely
-            5. Keep your tone friendly and conversational while maintaining professionalism
-
-            When formatting responses:
-            • For weather: Start with current conditions, then forecast
-            • For lists: Use bullet points and clear categories
-            • For explanations: Use short paragraphs with clear headings
-            • For data: Present in a structured, easy-to-read format
-            • For instructions: Use numbered steps
-
-            Keep your responses concise but informative, and always prioritize clarity."""
-        }
-        
-        conversation = [system_message] + list(reversed(messages))
-        return conversation
+        result = get_supabase().table('user_info').select('summary').eq('user_id', user_id).execute()
+    except Exception as e:
+        app.logger.error(f"Error getting history summary: {str(e)}")
+        return None
+    summary = result.data[0]['summary'] if result.data else None
+    summary_cache.set(user_id, summary)
+    return summary
+
+def get_conversation_history(user_id, limit=HISTORY_LIMIT):
+    """Get recent conversation turns for a user, oldest first, from the cache when warm."""
+    try:
+        messages = history_cache.get(user_id, limit)
+        if messages is None:
+            generation = history_cache.generation(user_id)
+            result = get_supabase().table('conversations').select('role', 'content').eq('user_id', user_id).order('timestamp', desc=True).limit(limit).execute()
+            messages = list(reversed(result.data))
+            history_cache.load(user_id, messages, complete=len(messages) < limit, generation=generation)
+        return messages
     except Exception as e:
         app.logger.error(f"Error getting conversation history: {str(e)}")
-        return [system_message]
+        return []
+
+def encode_cursor(row):
+    """Opaque keyset cursor for the position just before `row`."""
+    return base64.urlsafe_b64encode(json.dumps([row['timestamp'], row['id']]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on malformed cursors.
+
+    Both parts end up in a PostgREST filter, so they are re-serialized from
+    parsed values: an ISO timestamp and an integer or UUID id.
+    """
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        timestamp = parse_timestamp(timestamp).isoformat()
+        if isinstance(row_id, str):
+            row_id = str(uuid.UUID(row_id))
+        elif isinstance(row_id, bool) or not isinstance(row_id, int):
+            raise ValueError
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return timestamp, row_id
+
+def fetch_history_page(table, user_id, before, limit):
+    """Up to `limit` rows from `table`, newest first, strictly before the cursor."""
+    query = get_supabase().table(table).select('id', 'role', 'content', 'timestamp').eq('user_id', user_id)
+    if before:
+        timestamp, row_id = before
+        # Keyset condition: (timestamp, id) < (cursor timestamp, cursor id)
+        query = query.or_(f'timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lt.{row_id})')
+    return query.order('timestamp', desc=True).order('id', desc=True).limit(limit).execute().data
+
+def load_history_page(user_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """One page of a user's messages older than `before`, newest first.
+
+    Compacted turns are all older than the live ones, so once the live
+    table runs out, paging continues into conversations_archive. One row
+    more than requested is read to tell whether another page exists.
+    """
+    rows = fetch_history_page('conversations', user_id, before, limit + 1)
+    if len(rows) <= limit:
+        archive_before = (rows[-1]['timestamp'], rows[-1]['id']) if rows else before
+        try:
+            rows += fetch_history_page('conversations_archive', user_id, archive_before, limit + 1 - len(rows))
+        except Exception as e:
+            app.logger.error(f"Error reading archived history: {str(e)}")
+    return rows[:limit], len(rows) > limit
+
+def gzip_response(response):
+    """Gzip a response body when the client accepts it and it is big enough."""
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.headers.get('Accept-Encoding', '') or response.content_length is None \
+            or response.content_length < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app.route('/history')
+@login_required
+def history():
+    """Page backwards through the user's messages.
+
+    `before` is the `next_cursor` of the previous page; pages are returned
+    oldest first so they can be prepended as-is. Responses carry an ETag,
+    so revalidating an unchanged page costs a 304 and no body.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_PAGE_MAX)
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        rows, has_more = load_history_page(session['user_id'], before, limit)
+    except Exception as e:
+        app.logger.error(f"Error loading history page: {str(e)}")
+        return jsonify({"error": "Could not load history"}), 500
+
+    response = jsonify({
+        "messages": [{"id": row['id'], "role": row['role'], "content": row['content'], "timestamp": row['timestamp']}
+                     for row in reversed(rows)],
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None
+    })
+    # Weak, since the same page may be served gzipped or not
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest()[:32], weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+    return gzip_response(response)
+
+def recall_memories(user_id, user_message):
+    """Past exchanges relevant to the message, best first; [] on any error."""
+    memory = get_memory()
+    if memory is None:
+        return []
+    try:
+        return memory.search(user_id, user_message, k=MEMORY_TOP_K)
+    except Exception as e:
+        app.logger.error(f"Error recalling memories: {str(e)}")
+        return []
+
+def remember_exchange(user_id, user_message, bot_message):
+    """Index a finished exchange in the background."""
+    memory = get_memory()
+    if memory is None:
+        return
+    def index():
+        try:
+            memory.add(user_id, user_message, bot_message, timestamp=datetime.now(timezone.utc).isoformat())
+        except Exception as e:
+            app.logger.error(f"Error indexing memory: {str(e)}")
+    io_executor.submit(index)
 
-def save_message(user_id, role, content):
-    """Save a message to the conversation history."""
+def pack_context(context):
+    """Compress per-turn enrichment for the conversations.context column."""
+    return base64.b64encode(zlib.compress(context.encode('utf-8'))).decode('ascii')
+
+def unpack_context(packed):
+    """Inverse of pack_context."""
+    return zlib.decompress(base64.b64decode(packed)).decode('utf-8')
+
+def insert_conversation_rows(rows):
+    """Bulk-insert conversation rows, skipping any already stored.
+
+    An insert can commit and still raise (e.g. on a read timeout) and then be
+    retried or replayed from the journal; each row's message_id makes that
+    harmless. Omitted columns take their defaults rather than null.
+    """
+    get_supabase().table('conversations').upsert(
+        rows, on_conflict='message_id', ignore_duplicates=True, default_to_null=False
+    ).execute()
+
+def save_message(user_id, role, content, context=None):
+    """Save a message to the conversation history.
+
+    `content` is the raw message; enrichment such as search results goes in
+    `context`, stored compressed and expiring after CONTEXT_TTL seconds, so
+    history reads never carry it. With write-behind enabled the row is
+    queued and inserted in the background.
+    """
     try:
-        supabase.table('conversations').insert({
+        row = {
+            'message_id': str(uuid.uuid4()),
             'user_id': user_id,
             'role': role,
             'content': content
-        }).execute()
+        }
+        if context:
+            row['context'] = pack_context(context)
+            row['context_expires_at'] = (datetime.now(timezone.utc) + timedelta(seconds=CONTEXT_TTL)).isoformat()
+        writer = get_conversation_writer()
+        if writer:
+            # Stamp the row now so batching and replays keep turn order
+            row['timestamp'] = datetime.now(timezone.utc).isoformat()
+            writer.put(row)
+        else:
+            insert_conversation_rows([row])
+        history_cache.append(user_id, {'role': role, 'content': content})
     except Exception as e:
         app.logger.error(f"Error saving message: {str(e)}")
         raise
+    compactor = get_compactor()
+    if compactor:
+        compactor.mark(user_id)
+        compactor.start()
+    if context:
+        start_context_expiry()
+
+_context_expiry_thread = None
+
+def start_context_expiry():
+    """Start the thread that clears expired enrichment, once per process.
+
+    The table-wide update runs every CONTEXT_PURGE_INTERVAL seconds off the
+    request path; `flask expire-context` runs it on demand (e.g. from cron
+    where background threads don't survive, as on Vercel).
+    """
+    global _context_expiry_thread
+    if _context_expiry_thread is None:
+        with _clients_lock:
+            if _context_expiry_thread is None:
+                _context_expiry_thread = threading.Thread(target=_expire_context_loop, name='context-expiry', daemon=True)
+                _context_expiry_thread.start()
+
+def _expire_context_loop():
+    while True:
+        time.sleep(CONTEXT_PURGE_INTERVAL)
+        try:
+            expire_message_context()
+        except Exception as e:
+            app.logger.error(f"Error expiring message context: {str(e)}")
+
+def expire_message_context():
+    """Clear enrichment past its expiry; returns the number of rows cleared."""
+    result = get_supabase().table('conversations').update({
+        'context': None,
+        'context_expires_at': None
+    }).lt('context_expires_at', datetime.now(timezone.utc).isoformat()).execute()
+    return len(result.data)
+
+SERPAPI_URL = os.getenv('SERPAPI_URL', "https://serpapi.com/search")
+
+def serpapi_search(query):
+    """Query SerpAPI; returns None when there are no usable results."""
+    params = {
+        "q": query,
+        "api_key": os.getenv('SEARCH_API_KEY'),
+        "num": 3
+    }
+    with serpapi_limiter.slot():
+        response = serpapi_client.get(SERPAPI_URL, params=params)
+    serpapi_limiter.observe(response)
+    response.raise_for_status()
+    
+    data = response.json()
+    results = data.get("organic_results", [])
+    if not results:
+        return None
+        
+    snippets = [r.get("snippet", "") for r in results if "snippet" in r]
+    if snippets:
+        return "🌐 Real-time search results:\n" + " ".join(snippets)
+    return None
 
 def web_search(query):
-    """Perform a web search using SerpAPI."""
+    """Perform a web search, answering repeated queries from the cache."""
+    cached = search_cache.get(query)
+    if cached is not MISSING:
+        return cached
     try:
-        params = {
-            "q": query,
-            "api_key": os.getenv('SEARCH_API_KEY'),
-            "num": 3
-        }
-        response = requests.get("https://serpapi.com/search", params=params, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        results = data.get("organic_results", [])
-        if not results:
-            return None
-            
-        snippets = [r.get("snippet", "") for r in results if "snippet" in r]
-        if snippets:
-            return "🌐 Real-time search results:\n" + " ".join(snippets)
-        return None
+        result, shared = search_flight.do(query, serpapi_search, query)
     except Exception as e:
+        # Failures are not cached, so the next asker retries
         app.logger.error(f"Web search error: {str(e)}")
         return None
+    if not shared:
+        search_cache.set(query, result)
+    return result
+
+OPENROUTER_URL = os.getenv('OPENROUTER_URL', "https://openrouter.ai/api/v1/chat/completions")
+
+def redact_headers(headers):
+    """Copy of headers that is safe to log."""
+    return {k: ('Bearer ***' if k.lower() == 'authorization' else v) for k, v in headers.items()}
+
+def openrouter_headers():
+    """Build the OpenRouter request headers for the current request, if any."""
+    origin = request.headers.get('Origin') if has_request_context() else None
+    return {
+        "Authorization": f"Bearer {os.getenv('API_KEY')}",
+        "HTTP-Referer": origin or 'https://python-chatbot.com',
+        "X-Title": "ChatBot1",
+        "Content-Type": "application/json"
+    }
+
+class StageTimer:
+    """Record wall-clock durations for the stages of one chat turn.
+
+    Stages may run concurrently on the I/O pool, so recording is locked.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self._lock = threading.Lock()
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.sampled = random.random() < TRACE_SAMPLE_RATE
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def mark(self, name):
+        """Record the time since the turn started, once, as stage `name`."""
+        with self._lock:
+            self.timings.setdefault(name, time.perf_counter() - self.started)
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Run fn on the I/O pool, timed as stage `name`, and return its future."""
+        def run():
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return io_executor.submit(run)
+
+    def as_dict(self):
+        """Stage durations in milliseconds, plus the total so far."""
+        with self._lock:
+            timings = {name: round(elapsed * 1000, 1) for name, elapsed in self.timings.items()}
+        timings['total'] = round((time.perf_counter() - self.started) * 1000, 1)
+        return timings
+
+    def report(self, route):
+        """Export the turn's timings to /metrics and trace sampled turns.
+
+        Returns the timings in milliseconds.
+        """
+        total = time.perf_counter() - self.started
+        with self._lock:
+            timings = dict(self.timings)
+        for name, elapsed in timings.items():
+            STAGE_SECONDS.observe(elapsed, route=route, stage=name)
+        TURN_SECONDS.observe(total, route=route)
+        CHAT_TURNS.inc(route=route, status='ok')
+
+        timings_ms = self.as_dict()
+        if self.sampled:
+            app.logger.info(json.dumps({"trace_id": self.trace_id, "route": route, "timings_ms": timings_ms}))
+        return timings_ms
+
+def prepare_chat(user_id, user_message, timer, stream=False, search=None, short=False):
+    """Gather context for a turn and build the OpenRouter request body.
+
+    The body has no "model"; the model router adds one per attempt, so a
+    reply cached from one model can answer the same prompt routed to another.
+
+    Web search, the profile read and the history read have no data
+    dependency on each other, so they run concurrently on the I/O pool.
+    Writes (profile update, user message) are not needed by the prompt and
+    are returned as futures for the caller to await before it persists the
+    assistant reply. The user message is only saved once the history read
+    has finished, so the read can never return the new message as well.
+
+    `search` forces (True) or suppresses (False) the web search instead of
+    leaving it to the search gate.
+    """
+    pending_writes = []
+
+    # Handle web search for knowledge questions
+    search_future = None
+    if search_gate.should_search(user_message, override=search):
+        search_future = timer.submit('search', web_search, user_message)
+    
+    # Extract and save user information
+    user_info = extract_user_info(user_message)
+    if user_info:
+        pending_writes.append(timer.submit('profile_write', save_user_info, user_id, user_info))
+    profile_future = timer.submit('profile_read', get_user_info, user_id)
+
+    # The new message is appended by the prompt builder, not read back
+    history_future = timer.submit('history_read', get_conversation_history, user_id)
+    memory_future = timer.submit('memory_read', recall_memories, user_id, user_message)
+
+    search_result = search_future.result() if search_future else None
+
+    # Stored user info, including anything learned this turn
+    stored_info = {**profile_future.result(), **user_info}
+    # Usually already cached by the profile read
+    summary = get_history_summary(user_id)
+
+    history = history_future.result()
+    # Save user message in the background while the model generates
+    pending_writes.append(timer.submit('message_save', save_message, user_id, "user", user_message, context=search_result))
+
+    conversation, prompt_tokens = prompt_builder.build(
+        user_message,
+        history=history,
+        stored_info=stored_info,
+        search_context=search_result,
+        summary=summary,
+        memories=memory_future.result()
+    )
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug(f"Prompt: {len(conversation)} messages, ~{prompt_tokens} tokens")
+    
+    request_body = {
+        "messages": conversation,
+        "temperature": 0.5,  # Lower temperature for more consistent formatting
+        "max_tokens": SHORT_QUERY_MAX_TOKENS if short else MAX_TOKENS,
+        "stream": stream,
+        "top_p": 0.9,       # More focused responses
+        "frequency_penalty": 0.3,  # Reduce repetition
+        "presence_penalty": 0.3    # Encourage more diverse responses
+    }
+
+    return request_body, conversation, stored_info, pending_writes
+
+def search_override(data):
+    """Read the optional per-request "search": true/false flag."""
+    search = data.get('search')
+    return search if isinstance(search, bool) else None
+
+def wait_for_writes(pending_writes):
+    """Block until the turn's background writes finish, re-raising failures."""
+    for future in pending_writes:
+        future.result()
+
+def reply_cache_key(request_body, stored_info, data):
+    """Cache key for a turn's reply, or None when the turn must not be cached.
+
+    Turns that carry profile context are personalized and never cached, and
+    clients can opt out per request with "cache": false.
+    """
+    if not LLM_CACHE_ENABLED or stored_info or data.get('cache') is False:
+        return None
+    return request_cache_key(request_body)
+
+def post_completion(request_body, model, headers):
+    """Get one non-streamed completion from `model` and return its text."""
+    body = dict(request_body, model=model)
+
+    # Get response from API; the dumps are only built when DEBUG is on
+    debug = app.logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        app.logger.debug(f"Making API request to OpenRouter...")
+        app.logger.debug(f"Headers: {redact_headers(headers)}")
+        app.logger.debug(f"Request body: {json.dumps(body, indent=2)}")
+    
+    with openrouter_limiter.slot():
+        response = openrouter_client.post(
+            OPENROUTER_URL,
+            headers=headers,
+            data=json.dumps(body)
+        )
+    openrouter_limiter.observe(response)
+    
+    if debug:
+        app.logger.debug(f"Response status code: {response.status_code}")
+        app.logger.debug(f"Response headers: {dict(response.headers)}")
+        app.logger.debug(f"Response text: {response.text}")
+    
+    response.raise_for_status()
+    response_data = response.json()
+    
+    if 'choices' not in response_data or not response_data['choices']:
+        raise ValueError("Invalid response from API")
+        
+    return response_data['choices'][0]['message']['content']
+
+def reply_coalesce_key(request_body, stored_info, data):
+    """Key for sharing one in-flight completion among identical turns, or None.
+
+    Same rules as reply_cache_key, but independent of whether replies are cached.
+    """
+    if not LLM_COALESCE_ENABLED or stored_info or data.get('cache') is False:
+        return None
+    return request_cache_key(request_body)
+
+def complete_chat(request_body, timer, short=False):
+    """Get a completion through the model router; returns (model, formatted reply)."""
+    headers = openrouter_headers()
+    with timer.stage('llm'):
+        model, bot_message = model_router.call(
+            lambda model: post_completion(request_body, model, headers), short=short)
+    
+    # Clean, format and truncate the response
+    with timer.stage('format'):
+        return model, postprocess_response(bot_message, max_items=5)
+
+def summarize_history(messages):
+    """Run a compaction summary prompt; background work, so prefer cheap models."""
+    request_body = {"messages": messages, "temperature": 0.3, "max_tokens": SUMMARY_MAX_TOKENS, "stream": False}
+    headers = openrouter_headers()
+    _, summary = model_router.call(
+        lambda model: post_completion(request_body, model, headers), short=True, hedge=False)
+    return summary
+
+def open_stream(request_body, short=False):
+    """Open a streamed completion through the model router.
+
+    A model only counts as answering once its first token arrives, so an
+    error before that falls back to the next model; afterwards the stream
+    is committed. Returns (model, response, deltas, release_slot), where
+    deltas yields content including that first token.
+    """
+    headers = openrouter_headers()
+
+    def connect(model):
+        release_slot = openrouter_limiter.acquire()
+        response = None
+        try:
+            response = openrouter_client.post(
+                OPENROUTER_URL,
+                headers=headers,
+                data=json.dumps(dict(request_body, model=model)),
+                stream=True
+            )
+            openrouter_limiter.observe(response)
+            response.raise_for_status()
+            deltas = iter_stream_content(response)
+            first = next(deltas, None)
+        except Exception:
+            if response is not None:
+                response.close()
+            release_slot()
+            raise
+        return response, (deltas if first is None else chain([first], deltas)), release_slot
+
+    # Hedging would leave a second stream to drain, so streams only fall back
+    model, (response, deltas, release_slot) = model_router.call(
+        connect, short=short, hedge=False, record_latency=False)
+    return model, response, deltas, release_slot
+
+def iter_stream_content(response):
+    """Yield content deltas from an OpenRouter Server-Sent Events response."""
+    for line in response.iter_lines(decode_unicode=True):
+        # Skip keep-alive comments (": OPENROUTER PROCESSING") and blank lines
+        if not line or not line.startswith('data:'):
+            continue
+        payload = line[len('data:'):].strip()
+        if payload == '[DONE]':
+            break
+        chunk = json.loads(payload)
+        if 'error' in chunk:
+            raise ValueError(f"Stream error: {chunk['error'].get('message', chunk['error'])}")
+        choices = chunk.get('choices') or []
+        if choices:
+            content = choices[0].get('delta', {}).get('content')
+            if content:
+                yield content
+
+def sse_event(event, data):
+    """Serialize one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def retry_after_header(seconds):
+    return {"Retry-After": str(max(math.ceil(seconds), 1))}
+
+def admit_user(user_id):
+    """Take a token from the user's bucket; returns a 429 response if there is none."""
+    if user_limiter is None:
+        return None
+    allowed, retry_after = user_limiter.allow(user_id)
+    if allowed:
+        return None
+    CHAT_TURNS.inc(route=request.endpoint, status='rate_limited')
+    return jsonify({"error": "You're sending messages too quickly. Please wait a moment."}), 429, retry_after_header(retry_after)
+
+def chat_error_response(e):
+    """Log a chat failure and turn it into a JSON error response."""
+    CHAT_TURNS.inc(route=request.endpoint, status='error')
+    if isinstance(e, AdmissionError):
+        app.logger.warning(f"Upstream admission failed: {str(e)}")
+        return jsonify({"error": "The assistant is busy right now. Please try again shortly."}), 503, retry_after_header(e.retry_after)
+    if isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 429:
+        app.logger.warning(f"Upstream rate limited: {e.response.text}")
+        retry_after = parse_retry_after(e.response.headers.get('Retry-After'), 1.0)
+        return jsonify({"error": "The assistant is busy right now. Please try again shortly."}), 429, retry_after_header(retry_after)
+    if isinstance(e, requests.exceptions.HTTPError):
+        app.logger.error(f"HTTP Error: {str(e)}")
+        app.logger.error(f"Response status code: {e.response.status_code}")
+        app.logger.error(f"Response text: {e.response.text}")
+        return jsonify({"error": f"API Error: {e.response.status_code} - {e.response.text}"}), 500
+    if isinstance(e, requests.exceptions.RequestException):
+        app.logger.error(f"Request error: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": f"Request failed: {str(e)}"}), 500
+    app.logger.error(f"Chat error: {str(e)}")
+    app.logger.error(traceback.format_exc())
+    return jsonify({"error": str(e)}), 500
 
 @app.route('/chat', methods=['POST'])
 @login_required
@@ -321,6 +1064,9 @@ def chat():
     """Handle chat requests with persistent conversation memory."""
     try:
         user_id = session['user_id']
+        limited = admit_user(user_id)
+        if limited:
+            return limited
         data = request.get_json()
         
         if not data or 'message' not in data:
@@ -329,239 +1075,251 @@ def chat():
         user_message = data['message']
         app.logger.info(f"Processing message for user {user_id[:8]}: {user_message[:50]}...")
         
-        # Handle web search for knowledge questions
-        enhanced_message = user_message
-        if any(kw in user_message.lower() for kw in ["who", "what", "when", "where", "how", "why", "current", "latest"]):
-            search_result = web_search(user_message)
-            if search_result:
-                enhanced_message = f"{user_message}\n\nContext: {search_result}"
+        timer = StageTimer()
+        short = is_small_talk(user_message)
+        request_body, conversation, stored_info, pending_writes = prepare_chat(
+            user_id, user_message, timer, search=search_override(data), short=short)
+        cache_key = reply_cache_key(request_body, stored_info, data)
+        bot_message = reply_cache.get(cache_key) if cache_key else MISSING
+        cached = bot_message is not MISSING
+        model = None
+        shared = False
+        if not cached:
+            coalesce_key = reply_coalesce_key(request_body, stored_info, data)
+            if coalesce_key:
+                (model, bot_message), shared = llm_flight.do(coalesce_key, complete_chat, request_body, timer, short=short)
+            else:
+                model, bot_message = complete_chat(request_body, timer, short=short)
+            if cache_key and not shared:
+                reply_cache.set(cache_key, bot_message)
         
-        # Extract and save user information
-        user_info = extract_user_info(user_message)
-        if user_info:
-            save_user_info(user_id, user_info)
-            
-        # Add context from stored user info
-        stored_info = get_user_info(user_id)
-        if stored_info:
-            context = "Previous context: "
-            if 'name' in stored_info:
-                context += f"The user's name is {stored_info['name']}. "
-            enhanced_message = f"{context}\n\nCurrent message: {enhanced_message}"
-            
-        # Save user message and get conversation history
-        save_message(user_id, "user", enhanced_message)
-        conversation = get_conversation_history(user_id)
-        
-        # Prepare API request
-        headers = {
-            "Authorization": f"Bearer {os.getenv('API_KEY')}",
-            "HTTP-Referer": request.headers.get('Origin', 'https://python-chatbot.com'),
-            "X-Title": "ChatBot1",
-            "Content-Type": "application/json"
-        }
+        # Keep the user message ahead of the reply in the history
+        wait_for_writes(pending_writes)
+        with timer.stage('reply_save'):
+            save_message(user_id, "assistant", bot_message)
+        remember_exchange(user_id, user_message, bot_message)
         
-        request_body = {
-            "messages": conversation[-5:],
-            "model": "x-ai/grok-4-fast:free",
-            "temperature": 0.5,  # Lower temperature for more consistent formatting
-            "max_tokens": 500,   # Increased token limit for better formatting
-            "stream": False,
-            "top_p": 0.9,       # More focused responses
-            "frequency_penalty": 0.3,  # Reduce repetition
-            "presence_penalty": 0.3    # Encourage more diverse responses
-        }
-        
-        # Enhance the system message based on the type of query
-        if "weather" in user_message.lower():
-            request_body["messages"].insert(0, {
-                "role": "system",
-                "content": """Format weather information in a clean, structured way:
-                • Start with current conditions
-                • Show temperature with both °C and °F
-                • Highlight important weather alerts or changes
-                • Use bullet points for hourly breakdowns
-                • Put severe weather warnings in a separate section"""
-            })
-        elif any(word in user_message.lower() for word in ["list", "steps", "how to", "guide"]):
-            request_body["messages"].insert(0, {
-                "role": "system",
-                "content": """You are a concise and clear assistant. Format your responses following these rules:
-
-1. Keep responses brief and focused
-   • Limit lists to 5 items maximum
-   • One key point per item
-   • No lengthy explanations
-
-2. Use Simple Formatting
-   • Numbered steps for instructions
-   • Short, clear sentences
-   • No special characters or markers
-   • No repetition
-
-For bullet point lists:
-• Start each item with a bullet point (•)
-• Include a space after the bullet point
-• Keep items aligned and properly indented
-• Use sub-bullets for nested items
-
-For headings and sections:
-- Use clear, descriptive headings
-- Add a blank line before and after headings
-- Group related information under each heading
-- Use consistent formatting throughout
-
-Formatting rules:
-- Never use asterisks (*) for formatting
-- Use proper spacing and line breaks
-- Keep paragraphs short and focused
-- Use clear, simple language"""
-            })
-
-        # Get response from API
-        app.logger.debug(f"Making API request to OpenRouter...")
-        app.logger.debug(f"Headers: {headers}")
-        app.logger.debug(f"Request body: {json.dumps(request_body, indent=2)}")
-        
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(request_body),
-            timeout=30
-        )
-        
-        app.logger.debug(f"Response status code: {response.status_code}")
-        app.logger.debug(f"Response headers: {dict(response.headers)}")
-        app.logger.debug(f"Response text: {response.text}")
-        
-        response.raise_for_status()
-        response_data = response.json()
-        
-        if 'choices' not in response_data or not response_data['choices']:
-            raise ValueError("Invalid response from API")
-            
-        bot_message = response_data['choices'][0]['message']['content']
-        
-        # Clean up and format the response
-        def format_response(message):
-            def clean_text(text):
-                # Remove multiple spaces and clean up markers
-                text = ' '.join(text.split())
-                text = text.replace('###', '')
-                text = text.replace('**', '')
-                text = text.replace('*.', '•')
-                text = text.replace('•*', '•')
-                text = text.replace('*', '')
-                return text.strip()
-
-            def format_list_item(line, is_numbered=False):
-                # Format a single list item
-                line = clean_text(line)
-                if is_numbered and '. ' in line:
-                    num, content = line.split('. ', 1)
-                    if num.isdigit():
-                        return f"{num}. {content}"
-                return line
-
-            # Split response into sections
-            sections = message.split('\n\n')
-            formatted_sections = []
-
-            for section in sections:
-                lines = section.split('\n')
-                formatted_lines = []
-
-                # Process greeting or introduction separately
-                if not any(line.strip()[0].isdigit() for line in lines) and \
-                   not any('•' in line for line in lines) and \
-                   len(lines[0].split()) < 15:
-                    formatted_sections.append(clean_text(lines[0]))
-                    lines = lines[1:]
-                
-                # Format remaining lines
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    # Handle numbered items
-                    if line[0].isdigit() and '. ' in line[:4]:
-                        formatted_lines.append(format_list_item(line, is_numbered=True))
-                    # Handle bullet points
-                    elif '•' in line or line.lstrip().startswith('-'):
-                        line = line.replace('-', '•')
-                        formatted_lines.append(f"  • {clean_text(line.split('•', 1)[1])}")
-                    # Handle regular text
-                    else:
-                        formatted_lines.append(clean_text(line))
-
-                if formatted_lines:
-                    formatted_sections.append('\n'.join(formatted_lines))
-
-            # Join sections with proper spacing
-            return '\n\n'.join(formatted_sections)
-
-        def truncate_response(message, max_items=5):
-            # Split into sections
-            sections = message.split('\n\n')
-            
-            # Always keep the first section (greeting/intro)
-            result = [sections[0]]
-            
-            # Find and limit list items
-            list_items = []
-            for section in sections[1:]:
-                lines = section.split('\n')
-                for line in lines:
-                    if (line.strip().startswith(('1.', '2.', '3.', '4.', '5.', '•'))):
-                        list_items.append(line)
-                        if len(list_items) >= max_items:
-                            break
-                if len(list_items) >= max_items:
-                    break
-            
-            if list_items:
-                result.append('\n'.join(list_items))
-            
-            # Add a closing note if there were more items
-            if len(list_items) < sum(1 for section in sections[1:] for line in section.split('\n') 
-                                   if line.strip().startswith(('1.', '2.', '3.', '4.', '5.', '•'))):
-                result.append("Let me know if you'd like more suggestions.")
-            
-            return '\n\n'.join(result)
-        
-        # Clean and format the response
-        bot_message = format_response(bot_message)
-        
-        # Truncate if it's a list-type response
-        if any(line.strip().startswith(('1.', '•')) for line in bot_message.split('\n')):
-            bot_message = truncate_response(bot_message, max_items=5)
-        
-        save_message(user_id, "assistant", bot_message)
+        timings = timer.report('chat')
         
         return jsonify({
             "response": bot_message,
             "status": "success",
             "debug_info": {
                 "remembered_info": stored_info,
-                "conversation_length": len(conversation)
+                "conversation_length": len(conversation),
+                "cached": cached,
+                "coalesced": shared,
+                "model": model,
+                "timings": timings
             }
         })
         
-    except requests.exceptions.HTTPError as e:
-        app.logger.error(f"HTTP Error: {str(e)}")
-        app.logger.error(f"Response status code: {e.response.status_code}")
-        app.logger.error(f"Response text: {e.response.text}")
-        return jsonify({"error": f"API Error: {e.response.status_code} - {e.response.text}"}), 500
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Request error: {str(e)}")
-        app.logger.error(traceback.format_exc())
-        return jsonify({"error": f"Request failed: {str(e)}"}), 500
     except Exception as e:
-        app.logger.error(f"Chat error: {str(e)}")
-        app.logger.error(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        return chat_error_response(e)
+
+@app.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """Stream the reply as Server-Sent Events while the model generates it.
+
+    Events: ``delta`` carries raw tokens, ``section`` carries each formatted
+    section as soon as it is complete (plus the unformatted remainder), and
+    ``done`` carries the final formatted reply, which is what gets persisted.
+    """
+    try:
+        user_id = session['user_id']
+        limited = admit_user(user_id)
+        if limited:
+            return limited
+        data = request.get_json()
+        
+        if not data or 'message' not in data:
+            return jsonify({"error": "No message provided"}), 400
+            
+        user_message = data['message']
+        app.logger.info(f"Streaming message for user {user_id[:8]}: {user_message[:50]}...")
+        
+        timer = StageTimer()
+        short = is_small_talk(user_message)
+        request_body, conversation, stored_info, pending_writes = prepare_chat(
+            user_id, user_message, timer, stream=True, search=search_override(data), short=short)
+        
+        cache_key = reply_cache_key(request_body, stored_info, data)
+        cached_message = reply_cache.get(cache_key) if cache_key else MISSING
+        model = response = deltas = release_slot = None
+        if cached_message is MISSING:
+            # The upstream slot is held until the stream is fully read
+            with timer.stage('llm_connect'):
+                model, response, deltas, release_slot = open_stream(request_body, short=short)
+    except Exception as e:
+        return chat_error_response(e)
+
+    def generate():
+        try:
+            if cached_message is not MISSING:
+                bot_message = cached_message
+                yield sse_event('delta', {"content": bot_message})
+            else:
+                formatter = ResponseFormatter(max_items=5)
+                for content in deltas:
+                    timer.mark('first_token')
+                    yield sse_event('delta', {"content": content})
+                    for section in formatter.feed(content):
+                        yield sse_event('section', {"content": section, "pending": formatter.pending})
+                    # Everything after this point would be truncated away
+                    if formatter.complete:
+                        break
+                
+                bot_message = formatter.finish()
+                if cache_key:
+                    reply_cache.set(cache_key, bot_message)
+            
+            # Keep the user message ahead of the reply in the history
+            wait_for_writes(pending_writes)
+            with timer.stage('reply_save'):
+                save_message(user_id, "assistant", bot_message)
+            remember_exchange(user_id, user_message, bot_message)
+            
+            timings = timer.report('chat_stream')
+            
+            yield sse_event('done', {
+                "response": bot_message,
+                "status": "success",
+                "debug_info": {
+                    "remembered_info": stored_info,
+                    "conversation_length": len(conversation),
+                    "cached": cached_message is not MISSING,
+                    "model": model,
+                    "timings": timings
+                }
+            })
+        except Exception as e:
+            app.logger.error(f"Stream error: {str(e)}")
+            app.logger.error(traceback.format_exc())
+            CHAT_TURNS.inc(route='chat_stream', status='error')
+            if model is not None:
+                model_router.record(model, ok=False)
+            yield sse_event('error', {"error": str(e)})
+        finally:
+            if response is not None:
+                response.close()
+            if release_slot is not None:
+                release_slot()
+
+    stream = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering so tokens flush immediately
+        }
+    )
+    if release_slot is not None:
+        # generate() never runs if the client goes away before the first byte
+        stream.call_on_close(release_slot)
+    return stream
+
+@registry.collector
+def component_metrics():
+    """Counters kept by the pools, caches, search gate and write-behind queue."""
+    clients = http_clients.connection_stats()
+    yield ('chatbot_upstream_requests_total', 'counter', 'Requests sent to upstream APIs',
+           [({'client': name}, stats['requests']) for name, stats in clients.items()])
+    yield ('chatbot_upstream_connections_opened_total', 'counter', 'New upstream connections (the rest were reused)',
+           [({'client': name}, stats['connections_opened']) for name, stats in clients.items()])
+
+    caches = {
+        'history': history_cache.stats(),
+        'profile': profile_cache.stats(),
+        'search': search_cache.stats(),
+        'reply': reply_cache.stats(),
+    }
+    yield ('chatbot_cache_hits_total', 'counter', 'Cache lookups answered from memory',
+           [({'cache': name}, stats['hits']) for name, stats in caches.items()])
+    yield ('chatbot_cache_misses_total', 'counter', 'Cache lookups that fell through',
+           [({'cache': name}, stats['misses']) for name, stats in caches.items()])
+    yield ('chatbot_search_cache_negative_hits_total', 'counter', 'Searches answered by a cached empty result',
+           [({}, caches['search']['negative_hits'])])
+
+    yield ('chatbot_search_decisions_total', 'counter', 'Search gate decisions',
+           [({'decision': decision}, count) for decision, count in search_gate.stats().items()])
+
+    models, routing = model_router.stats()
+    yield ('chatbot_model_requests_total', 'counter', 'Completion attempts per model',
+           [({'model': name}, stats['requests']) for name, stats in models.items()])
+    yield ('chatbot_model_errors_total', 'counter', 'Failed completion attempts per model',
+           [({'model': name}, stats['errors']) for name, stats in models.items()])
+    yield ('chatbot_model_latency_seconds', 'gauge', 'Rolling completion latency quantiles per model',
+           [({'model': name, 'quantile': q}, stats[key])
+            for name, stats in models.items()
+            for q, key in (('0.5', 'p50'), ('0.95', 'p95')) if stats[key] is not None])
+    yield ('chatbot_model_routing_total', 'counter', 'Hedged requests, hedge outcomes and fallbacks',
+           [({'event': event}, count) for event, count in routing.items()])
+
+    limiters = {'openrouter': openrouter_limiter.stats(), 'serpapi': serpapi_limiter.stats()}
+    yield ('chatbot_upstream_in_flight', 'gauge', 'Upstream calls currently holding a concurrency slot',
+           [({'client': name}, stats['in_flight']) for name, stats in limiters.items()])
+    yield ('chatbot_upstream_throttled_total', 'counter', 'Upstream responses that asked us to back off',
+           [({'client': name}, stats['throttled']) for name, stats in limiters.items()])
+    rejected = [({'limiter': name}, stats['rejected']) for name, stats in limiters.items()]
+    if user_limiter is not None:
+        rejected.append(({'limiter': 'user'}, user_limiter.rejected))
+    yield ('chatbot_admission_rejected_total', 'counter', 'Calls turned away by a rate or concurrency limit', rejected)
+
+    flights = {'search': search_flight.snapshot(), 'llm': llm_flight.snapshot()}
+    yield ('chatbot_coalesced_calls_total', 'counter', 'Upstream calls made (leader), shared, or made after a wait timeout',
+           [({'call': name, 'outcome': outcome}, count)
+            for name, stats in flights.items() for outcome, count in stats.items()])
+
+    if session_interface is not None:
+        yield ('chatbot_session_operations_total', 'counter', 'Server-side session loads, misses, writes and deletions',
+               [({'operation': operation}, count) for operation, count in session_interface.snapshot().items()])
+
+    if _memory is not None:
+        yield ('chatbot_memory_operations_total', 'counter', 'Retrieval memory exchanges indexed, searches and recalls',
+               [({'operation': operation}, count) for operation, count in _memory.snapshot().items()])
+
+    if _compactor is not None:
+        yield ('chatbot_history_compaction_total', 'counter', 'History compaction results',
+               [({'result': result}, count) for result, count in _compactor.snapshot().items()])
+
+    if _conversation_writer is not None:
+        stats = _conversation_writer.snapshot()
+        yield ('chatbot_write_behind_pending', 'gauge', 'Conversation rows waiting to be inserted',
+               [({}, stats.pop('pending'))])
+        yield ('chatbot_write_behind_rows_total', 'counter', 'Conversation rows by write-behind outcome',
+               [({'outcome': outcome}, count) for outcome, count in stats.items()])
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition; set METRICS_TOKEN to require a bearer token."""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.cli.command('compact-history')
+@click.option('--user', 'user_id', help="Compact one user's history instead of every user's.")
+def compact_history_command(user_id):
+    """Summarize and archive conversation turns beyond the live window."""
+    compactor = get_compactor()
+    if compactor is None:
+        raise click.ClickException("Summarization is disabled (SUMMARY_ENABLED=0)")
+    compacted = compactor.compact_user(user_id) if user_id else compactor.compact_all()
+    click.echo(f"Compacted {compacted} turns")
+
+@app.cli.command('expire-context')
+def expire_context_command():
+    """Clear stored search context past CONTEXT_TTL."""
+    click.echo(f"Cleared context from {expire_message_context()} messages")
+
+@app.cli.command('purge-sessions')
+def purge_sessions_command():
+    """Delete expired server-side sessions."""
+    if session_interface is None:
+        raise click.ClickException("Sessions are stored in cookies (SESSION_BACKEND=cookie)")
+    click.echo(f"Purged {session_interface.purge_expired()} sessions")
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,51 @@
+"""Benchmarks for reply post-processing and user-info extraction.
+
+Run with pytest-benchmark (pip install pytest pytest-benchmark):
+
+    pytest benchmarks/bench_text_processing.py --benchmark-only
+
+Compare runs with --benchmark-autosave and --benchmark-compare to catch
+regressions in the per-request CPU spent formatting replies.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_processing import ResponseFormatter, extract_user_info, postprocess_response  # noqa: E402
+
+from corpus import REPLIES, USER_MESSAGES  # noqa: E402
+
+
+@pytest.mark.parametrize("name", list(REPLIES))
+def test_postprocess_response(benchmark, name):
+    reply = REPLIES[name]
+    result = benchmark(postprocess_response, reply)
+    assert result
+
+
+@pytest.mark.parametrize("name", ["numbered_list", "bullet_list", "long_prose"])
+def test_streaming_formatter(benchmark, name):
+    reply = REPLIES[name]
+    # Roughly token-sized chunks, as OpenRouter streams them
+    chunks = [reply[i:i + 6] for i in range(0, len(reply), 6)]
+
+    def stream():
+        formatter = ResponseFormatter()
+        for chunk in chunks:
+            formatter.feed(chunk)
+            if formatter.complete:
+                break
+        return formatter.finish()
+
+    assert benchmark(stream) == postprocess_response(reply)
+
+
+def test_extract_user_info(benchmark):
+    def extract_all():
+        return [extract_user_info(message) for message in USER_MESSAGES]
+
+    results = benchmark(extract_all)
+    assert results[1] == {'name': 'Priya'}
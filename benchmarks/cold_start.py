@@ -0,0 +1,65 @@
+"""Measure cold-start time: importing the app and serving its first request.
+
+Each sample runs in a fresh interpreter, like a new gunicorn worker or a
+Vercel cold start. No external services are needed; the first request is
+GET /login, which doesn't touch Supabase.
+
+    python benchmarks/cold_start.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/login')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_request_ms": (served - imported) * 1000,
+    "total_ms": (served - start) * 1000,
+    "supabase_imported": "supabase" in sys.modules,
+}))
+"""
+
+
+def sample():
+    env = dict(os.environ)
+    env.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+    env.setdefault("SUPABASE_KEY", "cold-start-benchmark")
+    env.setdefault("FLASK_SECRET_KEY", "cold-start-benchmark")
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    # Warm the OS file cache so every sample measures the same thing
+    sample()
+    samples = [sample() for _ in range(args.runs)]
+
+    print(f"{args.runs} cold starts")
+    for key in ("import_ms", "first_request_ms", "total_ms"):
+        values = sorted(s[key] for s in samples)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"  {key:<18} median {statistics.median(values):7.1f}  p95 {p95:7.1f}  max {values[-1]:7.1f}")
+    print(f"  supabase imported at startup: {any(s['supabase_imported'] for s in samples)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Realistic model replies used by the benchmarks.
+
+Shaped after what the model returns for this app's prompts: greetings,
+numbered lists, bullet lists with markdown leftovers, weather reports and
+long prose.
+"""
+
+GREETING = "Hello! 😊 How can I assist you today?"
+
+NUMBERED_LIST = """Here are some easy ways to improve your sleep:
+
+1. **Keep a consistent schedule** - go to bed and wake up at the same time every day, even on weekends.
+2. **Limit screens before bed** - blue light from phones and laptops delays melatonin release.
+3. **Watch your caffeine** - avoid coffee, tea and energy drinks after 2 PM.
+4. **Make your room dark and cool** - around 18°C (65°F) works for most people.
+5. **Get morning sunlight** - 10 minutes outside helps set your body clock.
+6. **Move your body** - regular exercise improves sleep quality, but not right before bed.
+7. **Wind down** - reading or stretching signals your body that it's time to rest.
+
+Let me know if you'd like tips for a specific problem, like waking up at night!"""
+
+BULLET_LIST = """### Packing checklist for a weekend hike
+
+• *Water* - at least 2 liters per person
+• *Snacks* - nuts, dried fruit, energy bars
+• **Layers** - a fleece and a waterproof jacket
+- Map and compass (don't rely only on your phone)
+- First aid kit
+- Headlamp with spare batteries
+*. Sunscreen and a hat
+•* Trekking poles for steep sections
+
+### Before you go
+
+Check the forecast and tell someone your route and expected return time."""
+
+WEATHER = """Current conditions in London:
+
+• Temperature: 14°C (57°F), feels like 12°C (54°F)
+• Sky: Partly cloudy
+• Wind: 18 km/h from the southwest
+• Humidity: 72%
+
+### Forecast
+
+1. This afternoon: showers likely, high of 15°C (59°F)
+2. Tonight: clearing skies, low of 8°C (46°F)
+3. Tomorrow: sunny spells, high of 17°C (63°F)
+
+### Alerts
+
+No severe weather warnings are in effect."""
+
+PROSE = "\n\n".join([
+    "Photosynthesis is the process plants, algae and some bacteria use to turn light energy into chemical energy. "
+    "It takes place mainly in the chloroplasts of leaf cells, where the pigment chlorophyll absorbs red and blue light "
+    "and reflects green, which is why most leaves look green to us.",
+    "The process has two linked stages. In the light-dependent reactions, energy from sunlight splits water molecules, "
+    "releasing oxygen and producing ATP and NADPH. In the Calvin cycle, which does not need light directly, the plant "
+    "uses that ATP and NADPH to fix carbon dioxide from the air into sugars such as glucose.",
+    "Those sugars fuel the plant's growth and, further up the food chain, nearly every living thing on Earth. "
+    "Photosynthesis also produced the oxygen in our atmosphere over billions of years, making complex life possible.",
+    "Factors like light intensity, carbon dioxide concentration and temperature all limit how fast it can happen, "
+    "which is why greenhouses often add extra CO2 and lighting to boost crop yields.",
+] * 3)
+
+MIXED = "\n\n".join([NUMBERED_LIST, BULLET_LIST, PROSE])
+
+REPLIES = {
+    "greeting": GREETING,
+    "numbered_list": NUMBERED_LIST,
+    "bullet_list": BULLET_LIST,
+    "weather": WEATHER,
+    "long_prose": PROSE,
+    "mixed": MIXED,
+}
+
+USER_MESSAGES = [
+    "hii",
+    "My name is Priya and I live in Pune",
+    "what's the weather like in London today?",
+    "can you give me a list of steps to learn python",
+    "I'm trying to sleep better, any tips?",
+    "call me Sam from now on",
+    "Tell me a long story about dragons and knights in a faraway kingdom " * 4,
+]
@@ -0,0 +1,426 @@
+"""Local stand-ins for Supabase (PostgREST), OpenRouter and SerpAPI.
+
+One threaded HTTP server answers all three, with configurable latency,
+error rates and streaming speed, so the app can be load-tested without
+network access or quota:
+
+    SUPABASE_URL    http://127.0.0.1:<port>            (key: see FAKE_SUPABASE_KEY)
+    OPENROUTER_URL  http://127.0.0.1:<port>/api/v1/chat/completions
+    SERPAPI_URL     http://127.0.0.1:<port>/search
+
+The PostgREST fake keeps tables in memory and understands the subset of
+the query syntax the app uses: eq/neq/lt/lte/gt/gte/is/in filters, or=()
+and and() groups, select, order, limit/offset and upserts. Run it
+standalone with
+
+    python benchmarks/fake_services.py --port 8787 --llm-latency 0.8
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+try:
+    from corpus import REPLIES
+except ImportError:
+    from benchmarks.corpus import REPLIES
+
+# Passes supabase-py's API key format check
+FAKE_SUPABASE_KEY = "bench.fake.key"
+
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'lt': lambda a, b: a < b,
+    'lte': lambda a, b: a <= b,
+    'gt': lambda a, b: a > b,
+    'gte': lambda a, b: a >= b,
+}
+
+
+class ServiceProfile:
+    """Latency and failure behaviour of one fake upstream.
+
+    Each request waits `latency` seconds, +/- `jitter` as a fraction, and
+    fails with `error_status` with probability `error_rate`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.2, error_rate=0.0, error_status=500):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def delay(self):
+        if self.latency:
+            time.sleep(max(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter), 0))
+
+    def fails(self):
+        return random.random() < self.error_rate
+
+
+def _split_top_level(text):
+    """Split on commas that are outside parentheses and double quotes."""
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _unquote(value):
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+def _compare(op, left, right):
+    if left is None:
+        return False
+    if isinstance(left, (int, float)) and not isinstance(left, bool):
+        try:
+            right = type(left)(right)
+        except ValueError:
+            return False
+    else:
+        left = str(left)
+    return OPERATORS[op](left, right)
+
+
+def _condition(column, expression):
+    """A row predicate for one PostgREST `column=op.value` filter."""
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[4:]
+    op, _, value = expression.partition('.')
+    if op == 'is':
+        expected = {'null': None, 'true': True, 'false': False}[value]
+        test = lambda row: row.get(column) is expected  # noqa: E731
+    elif op == 'in':
+        values = {_unquote(v) for v in _split_top_level(value.strip('()'))}
+        test = lambda row: str(row.get(column)) in values  # noqa: E731
+    elif op in OPERATORS:
+        value = _unquote(value)
+        test = lambda row: _compare(op, row.get(column), value)  # noqa: E731
+    else:
+        raise ValueError(f"Unsupported operator {op!r}")
+    return (lambda row: not test(row)) if negate else test
+
+
+def _group(kind, body):
+    """A row predicate for an or=(...) / and(...) group."""
+    predicates = []
+    for item in _split_top_level(body):
+        match = re.match(r'^(and|or)\((.*)\)$', item)
+        if match:
+            predicates.append(_group(match.group(1), match.group(2)))
+        else:
+            column, _, expression = item.partition('.')
+            predicates.append(_condition(column, expression))
+    combine = any if kind == 'or' else all
+    return lambda row: combine(p(row) for p in predicates)
+
+
+class FakePostgREST:
+    """In-memory tables behind the PostgREST query syntax."""
+
+    def __init__(self):
+        self.tables = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def handle(self, method, table, params, body, prefer):
+        filters = []
+        options = {}
+        for key, value in params:
+            if key in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns'):
+                options[key] = value
+            elif key in ('or', 'and'):
+                filters.append(_group(key, value[1:-1]))
+            else:
+                filters.append(_condition(key, value))
+
+        with self._lock:
+            rows = self.tables.setdefault(table, [])
+            if method == 'GET':
+                return 200, self._select(rows, filters, options)
+            if method == 'POST':
+                return 201, self._insert(table, rows, body, options, prefer)
+            matched = [row for row in rows if all(f(row) for f in filters)]
+            if method == 'PATCH':
+                for row in matched:
+                    row.update(body)
+            elif method == 'DELETE':
+                self.tables[table] = [row for row in rows if not all(f(row) for f in filters)]
+            return 200, [dict(row) for row in matched]
+
+    def _select(self, rows, filters, options):
+        matched = [row for row in rows if all(f(row) for f in filters)]
+        for term in reversed(options.get('order', '').split(',') if options.get('order') else []):
+            column, _, direction = term.partition('.')
+            desc = direction.startswith('desc')
+            present = [row for row in matched if row.get(column) is not None]
+            missing = [row for row in matched if row.get(column) is None]
+            present.sort(key=lambda row: row[column], reverse=desc)
+            matched = present + missing
+        offset = int(options.get('offset', 0))
+        if 'limit' in options:
+            matched = matched[offset:offset + int(options['limit'])]
+        else:
+            matched = matched[offset:]
+        columns = options.get('select', '*')
+        if columns == '*':
+            return [dict(row) for row in matched]
+        names = [c.strip() for c in columns.split(',')]
+        return [{name: row.get(name) for name in names} for row in matched]
+
+    def _insert(self, table, rows, body, options, prefer):
+        items = body if isinstance(body, list) else [body]
+        ignore = 'ignore-duplicates' in prefer
+        conflict = options.get('on_conflict') if ignore or 'merge-duplicates' in prefer else None
+        written = []
+        for item in items:
+            item = dict(item)
+            if conflict:
+                existing = next((row for row in rows if row.get(conflict) == item.get(conflict)), None)
+                if existing is not None:
+                    if not ignore:
+                        existing.update(item)
+                        written.append(dict(existing))
+                    continue
+            item.setdefault('id', next(self._ids))
+            if table.startswith('conversations'):
+                item.setdefault('timestamp', datetime.now(timezone.utc).isoformat())
+            rows.append(item)
+            written.append(dict(item))
+        return written
+
+
+def _reply_for(body):
+    """Pick a corpus reply; stable per prompt so repeated prompts match."""
+    replies = list(REPLIES.values())
+    last = body.get('messages', [{}])[-1].get('content', '')
+    return replies[sum(map(ord, last)) % len(replies)]
+
+
+def make_handler(services):
+    """Build a request handler bound to a FakeServices instance."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length)) if length else None
+
+        def _send_json(self, status, payload, headers=None):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _route(self, method):
+            url = urlsplit(self.path)
+            # Always drain the body: postgrest-py sends "{}" even with GET and
+            # DELETE, and unread bytes would corrupt the next keep-alive request
+            body = self._body()
+            if method not in ('POST', 'PATCH'):
+                body = None
+            services.count(url.path)
+            if url.path.startswith('/rest/v1/'):
+                return self._postgrest(method, url, body)
+            if url.path.endswith('/chat/completions') and method == 'POST':
+                return self._completion(body)
+            if url.path == '/search' and method == 'GET':
+                return self._search(dict(parse_qsl(url.query)))
+            self._send_json(404, {"error": f"No fake for {method} {url.path}"})
+
+        def _postgrest(self, method, url, body):
+            profile = services.supabase
+            profile.delay()
+            if profile.fails():
+                return self._send_json(profile.error_status, {"message": "fake database error", "code": "XX000"})
+            table = url.path[len('/rest/v1/'):]
+            try:
+                status, rows = services.db.handle(method, table, parse_qsl(url.query, keep_blank_values=True),
+                                                  body, self.headers.get('Prefer', ''))
+            except (ValueError, KeyError) as e:
+                return self._send_json(400, {"message": str(e), "code": "PGRST100"})
+            self._send_json(status, rows)
+
+        def _completion(self, body):
+            profile = services.openrouter
+            profile.delay()
+            if profile.fails():
+                headers = {'Retry-After': '1'} if profile.error_status == 429 else None
+                return self._send_json(profile.error_status, {"error": {"message": "fake upstream error"}}, headers)
+            reply = _reply_for(body)
+            # Generation time: roughly four characters per token
+            tokens = [reply[i:i + 4] for i in range(0, len(reply), 4)]
+            tokens = tokens[:body.get('max_tokens') or len(tokens)]
+            if not body.get('stream'):
+                time.sleep(len(tokens) / services.tokens_per_second)
+                return self._send_json(200, {
+                    "model": body.get('model'),
+                    "choices": [{"message": {"role": "assistant", "content": ''.join(tokens)}}],
+                })
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            try:
+                self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+                for token in tokens:
+                    time.sleep(1 / services.tokens_per_second)
+                    chunk = {"model": body.get('model'), "choices": [{"delta": {"content": token}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The app stops reading once the reply would be truncated
+                pass
+
+        def _search(self, params):
+            profile = services.serpapi
+            profile.delay()
+            if profile.fails():
+                return self._send_json(profile.error_status, {"error": "fake search error"})
+            query = params.get('q', '')
+            self._send_json(200, {"organic_results": [
+                {"title": f"Result {i} for {query}", "snippet": f"Snippet {i} about {query}."}
+                for i in range(1, int(params.get('num', 3)) + 1)
+            ]})
+
+        def do_GET(self):
+            self._route('GET')
+
+        def do_POST(self):
+            self._route('POST')
+
+        def do_PATCH(self):
+            self._route('PATCH')
+
+        def do_DELETE(self):
+            self._route('DELETE')
+
+    return Handler
+
+
+class FakeServices:
+    """Runs the fakes on a background thread; use as a context manager."""
+
+    def __init__(self, host='127.0.0.1', port=0, supabase=None, openrouter=None, serpapi=None,
+                 tokens_per_second=200):
+        self.supabase = supabase or ServiceProfile()
+        self.openrouter = openrouter or ServiceProfile()
+        self.serpapi = serpapi or ServiceProfile()
+        self.tokens_per_second = tokens_per_second
+        self.db = FakePostgREST()
+        self.requests = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Environment variables pointing the app at these fakes."""
+        return {
+            'SUPABASE_URL': self.url,
+            'SUPABASE_KEY': FAKE_SUPABASE_KEY,
+            'OPENROUTER_URL': f"{self.url}/api/v1/chat/completions",
+            'SERPAPI_URL': f"{self.url}/search",
+            'API_KEY': 'fake',
+            'SEARCH_API_KEY': 'fake',
+        }
+
+    def count(self, path):
+        key = 'supabase' if path.startswith('/rest/') else 'openrouter' if path.endswith('/completions') else 'serpapi'
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-services', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def add_profile_arguments(parser):
+    """Add --<service>-latency/-error-rate/... options to an argparse parser."""
+    for name, latency in (('supabase', 0.02), ('llm', 0.5), ('search', 0.3)):
+        parser.add_argument(f'--{name}-latency', type=float, default=latency,
+                            help=f"seconds per {name} request (default {latency})")
+        parser.add_argument(f'--{name}-error-rate', type=float, default=0.0,
+                            help=f"fraction of {name} requests that fail")
+    parser.add_argument('--llm-error-status', type=int, default=503,
+                        help="status for failed completions; 429 adds Retry-After")
+    parser.add_argument('--llm-tps', type=float, default=200, help="streamed tokens per second")
+    parser.add_argument('--jitter', type=float, default=0.2, help="latency jitter as a fraction")
+
+
+def services_from_args(args, port=0):
+    return FakeServices(
+        port=port,
+        supabase=ServiceProfile(args.supabase_latency, args.jitter, args.supabase_error_rate),
+        openrouter=ServiceProfile(args.llm_latency, args.jitter, args.llm_error_rate, args.llm_error_status),
+        serpapi=ServiceProfile(args.search_latency, args.jitter, args.search_error_rate),
+        tokens_per_second=args.llm_tps,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8787)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    services = services_from_args(args, port=args.port).start()
+    print(f"Fake services on {services.url}; point the app at them with:")
+    for key, value in services.env().items():
+        print(f"  export {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        services.stop()
+
+
+if __name__ == '__main__':
+    main()
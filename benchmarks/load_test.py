@@ -0,0 +1,260 @@
+"""Load-test the app under gunicorn against local fake upstreams.
+
+Starts the fakes from fake_services.py, then for every workers x threads
+combination runs gunicorn, registers one user per client thread and drives
+a weighted mix of /chat, /chat/stream, /login and /register for a fixed
+duration. Reports throughput, latency percentiles per endpoint and the
+per-stage breakdown the app returns in debug_info.timings.
+
+    python benchmarks/load_test.py --workers 1,2,4 --threads 1,8 --concurrency 16 --duration 20
+
+Upstream behaviour is tunable (see --help): e.g. --llm-latency 2
+--llm-error-rate 0.05 --llm-error-status 429 to rehearse a throttled model.
+Use --json to save results for comparing runs.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import USER_MESSAGES  # noqa: E402
+from fake_services import add_profile_arguments, services_from_args  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = "load-test-password"
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(text):
+    """'chat=8,stream=2' -> ([ops], [weights])."""
+    pairs = [item.split('=') for item in text.split(',') if item]
+    return [op for op, _ in pairs], [float(weight) for _, weight in pairs]
+
+
+class Client:
+    """One simulated user with its own session, driving requests in a loop."""
+
+    def __init__(self, base_url, args):
+        self.base_url = base_url
+        self.args = args
+        self.session = requests.Session()
+        self.username = f"load-{uuid.uuid4().hex[:12]}"
+        self.results = []
+
+    def register(self, session=None, username=None):
+        return (session or self.session).post(f"{self.base_url}/register", data={
+            'username': username or self.username,
+            'password': PASSWORD,
+            'confirm_password': PASSWORD,
+        }, allow_redirects=False)
+
+    def chat(self):
+        payload = {'message': random.choice(USER_MESSAGES)}
+        if self.args.no_cache:
+            payload['cache'] = False
+        response = self.session.post(f"{self.base_url}/chat", json=payload)
+        timings = response.json().get('debug_info', {}).get('timings') if response.ok else None
+        return response, timings
+
+    def stream(self):
+        payload = {'message': random.choice(USER_MESSAGES)}
+        if self.args.no_cache:
+            payload['cache'] = False
+        response = self.session.post(f"{self.base_url}/chat/stream", json=payload, stream=True,
+                                     headers={'Accept': 'text/event-stream'})
+        timings = None
+        first_byte = None
+        for line in response.iter_lines(decode_unicode=True):
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            if line.startswith('data:') and '"debug_info"' in line:
+                timings = json.loads(line[5:]).get('debug_info', {}).get('timings')
+            if line.startswith('event: error'):
+                response.status_code = 599
+        response.close()
+        return response, timings
+
+    def login(self):
+        response = requests.post(f"{self.base_url}/login", data={
+            'username': self.username, 'password': PASSWORD
+        }, allow_redirects=False)
+        return response, None
+
+    def register_new(self):
+        return self.register(requests.Session(), f"load-{uuid.uuid4().hex[:12]}"), None
+
+    def run(self, ops, weights, deadline):
+        actions = {'chat': self.chat, 'stream': self.stream, 'login': self.login, 'register': self.register_new}
+        while time.perf_counter() < deadline:
+            op = random.choices(ops, weights)[0]
+            start = time.perf_counter()
+            try:
+                response, timings = actions[op]()
+                status = response.status_code
+            except requests.RequestException:
+                status, timings = 0, None
+            self.results.append((op, status, time.perf_counter() - start, timings))
+
+
+def start_gunicorn(port, workers, threads, env):
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+               '--bind', f'127.0.0.1:{port}', '--timeout', '120', '--log-level', 'warning', 'app:app']
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/healthz', timeout=1).ok:
+                return process
+        except requests.RequestException:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not become healthy within 30s")
+
+
+def run_config(args, workers, threads):
+    services = services_from_args(args).start()
+    scratch = tempfile.mkdtemp(prefix='chatbot-load-')
+    env = dict(os.environ)
+    env.update(services.env())
+    env.update({
+        # Every worker must sign sessions with the same key
+        'FLASK_SECRET_KEY': 'load-test',
+        'LOG_LEVEL': 'WARNING',
+        'PERSIST_JOURNAL_DIR': scratch,
+        'MEMORY_DIR': os.path.join(scratch, 'memory'),
+        'SESSION_DB_PATH': os.path.join(scratch, 'sessions.sqlite3'),
+    })
+    if not args.rate_limit:
+        env['USER_RATE_PER_MINUTE'] = '0'
+    port = free_port()
+    process = start_gunicorn(port, workers, threads, env)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        clients = [Client(base_url, args) for _ in range(args.concurrency)]
+        for client in clients:
+            response = client.register()
+            if response.status_code != 302:
+                raise RuntimeError(f"Registering a load-test user failed with {response.status_code}")
+
+        ops, weights = parse_mix(args.mix)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        runners = [threading.Thread(target=client.run, args=(ops, weights, deadline)) for client in clients]
+        for runner in runners:
+            runner.start()
+        for runner in runners:
+            runner.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        services.stop()
+
+    results = list(itertools.chain.from_iterable(client.results for client in clients))
+    return summarize(results, elapsed, workers, threads, dict(services.requests))
+
+
+def summarize(results, elapsed, workers, threads, upstream):
+    report = {
+        'workers': workers,
+        'threads': threads,
+        'requests': len(results),
+        'rps': len(results) / elapsed,
+        'endpoints': {},
+        'stages': {},
+        'upstream_requests': upstream,
+    }
+    for op in sorted({op for op, *_ in results}):
+        latencies = [latency for o, _, latency, _ in results if o == op]
+        errors = sum(1 for o, status, _, _ in results if o == op and not 200 <= status < 400)
+        report['endpoints'][op] = {
+            'count': len(latencies),
+            'rps': len(latencies) / elapsed,
+            'errors': errors,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    stages = {}
+    for _, _, _, timings in results:
+        for stage, ms in (timings or {}).items():
+            stages.setdefault(stage, []).append(ms)
+    for stage, values in sorted(stages.items()):
+        report['stages'][stage] = {
+            'count': len(values),
+            'mean_ms': statistics.fmean(values),
+            'p50_ms': percentile(values, 0.50),
+            'p95_ms': percentile(values, 0.95),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n== {report['workers']} workers x {report['threads']} threads: "
+          f"{report['requests']} requests, {report['rps']:.1f} req/s")
+    print(f"  {'endpoint':<10} {'count':>7} {'req/s':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for op, stats in report['endpoints'].items():
+        print(f"  {op:<10} {stats['count']:>7} {stats['rps']:>7.1f} {stats['errors']:>7} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+    if report['stages']:
+        print(f"  {'stage':<16} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for stage, stats in report['stages'].items():
+            print(f"  {stage:<16} {stats['count']:>7} {stats['mean_ms']:>9.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f}")
+    print(f"  upstream requests: {report['upstream_requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='2', help="comma-separated gunicorn worker counts")
+    parser.add_argument('--threads', default='4', help="comma-separated threads per worker")
+    parser.add_argument('--concurrency', type=int, default=8, help="simulated users sending requests")
+    parser.add_argument('--duration', type=float, default=15, help="seconds per configuration")
+    parser.add_argument('--mix', default='chat=6,stream=2,login=1,register=1',
+                        help="weighted request mix of chat, stream, login and register")
+    parser.add_argument('--no-cache', action='store_true', help='send "cache": false with chat requests')
+    parser.add_argument('--rate-limit', action='store_true', help="keep the per-user rate limit on")
+    parser.add_argument('--json', help="write all reports to this file")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    reports = []
+    for workers in (int(w) for w in args.workers.split(',')):
+        for threads in (int(t) for t in args.threads.split(',')):
+            report = run_config(args, workers, threads)
+            print_report(report)
+            reports.append(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""In-process caches that keep hot data off the Supabase round trip path.
+
+All caches are thread-safe (chat turns fan out on a thread pool) and
+bounded, and count hits and misses so their effectiveness can be checked.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class ConversationCache:
+    """Recent conversation turns per user, written through by save_message.
+
+    Each user gets a ring buffer of their latest turns. Users are evicted
+    least-recently-used first once there are more than max_users of them or
+    the cached message text exceeds max_chars. Entries expire after ttl
+    seconds so rows written by other workers are picked up eventually;
+    until then, a user whose turns alternate between workers gets history
+    with gaps from each of them, so keep ttl short when running several.
+
+    A database read can race a save: the save's append finds the user cold
+    and is skipped, then the read, which started before the insert, fills
+    the buffer without it. Callers take generation() before reading and
+    pass it to load(), which refuses to cache a read that an append
+    overtook.
+    """
+
+    def __init__(self, turns_per_user=20, max_users=1000, max_chars=8_000_000, ttl=60):
+        self.turns_per_user = turns_per_user
+        self.max_users = max_users
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._chars = 0
+        # Per-user stamp of the latest append, cold users included; users
+        # forgotten from here report the highest stamp forgotten so far
+        self._generations = OrderedDict()
+        self._generation = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, user_id):
+        """Stamp to pass to load() for a database read starting now."""
+        with self._lock:
+            return self._generations.get(user_id, self._forgotten)
+
+    def get(self, user_id, limit):
+        """Return up to `limit` most recent turns, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry['loaded_at'] > self.ttl:
+                self._drop(user_id)
+                entry = None
+            # The buffer can answer if it holds enough turns, or all there are
+            if entry is None or (len(entry['turns']) < limit and not entry['complete']):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            turns = list(entry['turns'])[-limit:] if limit else []
+            return [dict(turn) for turn in turns]
+
+    def load(self, user_id, turns, complete, generation=None):
+        """Replace a user's buffer with turns read from the database.
+
+        `turns` is ordered oldest to newest; `complete` says whether they are
+        the user's entire history rather than just the latest page. If
+        `generation` is given and a turn was appended since it was taken,
+        the read may be missing that turn and is not cached.
+        """
+        with self._lock:
+            if generation is not None and self._generations.get(user_id, self._forgotten) != generation:
+                return
+            self._drop(user_id)
+            buffer = deque(maxlen=self.turns_per_user)
+            for turn in turns:
+                buffer.append(dict(turn))
+            # Anything that didn't fit is history the buffer no longer covers
+            complete = complete and len(turns) <= self.turns_per_user
+            self._entries[user_id] = {
+                'turns': buffer,
+                'complete': complete,
+                'chars': sum(len(turn.get('content') or '') for turn in buffer),
+                'loaded_at': time.monotonic(),
+            }
+            self._chars += self._entries[user_id]['chars']
+            self._evict()
+
+    def append(self, user_id, turn):
+        """Add a newly saved turn to a cached user; cold users are skipped."""
+        with self._lock:
+            self._generation += 1
+            self._generations[user_id] = self._generation
+            self._generations.move_to_end(user_id)
+            while len(self._generations) > 2 * self.max_users:
+                _, forgotten = self._generations.popitem(last=False)
+                self._forgotten = max(self._forgotten, forgotten)
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            buffer = entry['turns']
+            if len(buffer) == buffer.maxlen:
+                dropped = len(buffer[0].get('content') or '')
+                entry['chars'] -= dropped
+                self._chars -= dropped
+                entry['complete'] = False
+            buffer.append(dict(turn))
+            size = len(turn.get('content') or '')
+            entry['chars'] += size
+            self._chars += size
+            self._entries.move_to_end(user_id)
+            self._evict()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._drop(user_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._entries),
+                'chars': self._chars,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _drop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._chars -= entry['chars']
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_users or self._chars > self.max_chars):
+            user_id = next(iter(self._entries))
+            self._drop(user_id)
+
+
+# Returned by cache lookups on a miss, so that None can be cached as a value
+MISSING = object()
+
+
+class TTLCache:
+    """A size-bounded LRU mapping whose entries expire after ttl seconds."""
+
+    def __init__(self, max_entries=1000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() >= entry[1]:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class KeyedLocks:
+    """A fixed set of locks shared out by key hash, for per-key critical sections."""
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class SQLiteStore:
+    """JSON values with expiry in a local SQLite file.
+
+    Survives worker restarts and is shared by every worker on the host.
+    """
+
+    def __init__(self, path, table='cache'):
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return (value, seconds left) for a live key, or MISSING."""
+        row = self._connection().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return MISSING
+        remaining = row[1] - time.time()
+        if remaining <= 0:
+            return MISSING
+        return json.loads(row[0]), remaining
+
+    def set(self, key, value, ttl):
+        with self._connection() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl)
+            )
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        with self._connection() as conn:
+            return conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+_QUERY_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_query(query):
+    """Reduce a search query to lowercase words, ignoring punctuation and spacing."""
+    return ' '.join(_QUERY_WORD_RE.findall(query.lower()))
+
+
+class SearchCache:
+    """Web search results keyed by normalized query.
+
+    Queries that found nothing are cached as None for the shorter
+    negative_ttl. With a path, entries are also written to a SQLiteStore
+    so they outlive the process.
+    """
+
+    def __init__(self, max_entries=5000, ttl=3600, negative_ttl=300, path=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.store = SQLiteStore(path, table='search_cache') if path else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, query):
+        """Return the cached result (possibly None) or MISSING."""
+        key = normalize_query(query)
+        value = self.memory.get(key)
+        if value is MISSING and self.store is not None:
+            stored = self.store.get(key)
+            if stored is not MISSING:
+                value, remaining = stored
+                self.memory.set(key, value, ttl=remaining)
+        with self._lock:
+            if value is MISSING:
+                self.misses += 1
+            elif value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, query, result):
+        key = normalize_query(query)
+        ttl = self.ttl if result else self.negative_ttl
+        self.memory.set(key, result, ttl=ttl)
+        if self.store is not None:
+            self.store.set(key, result, ttl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': self.memory.stats()['entries'],
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+            }
+
+
+# Request fields that don't change what the model answers
+_UNKEYED_FIELDS = ('stream',)
+
+
+def request_cache_key(request_body):
+    """Hash a chat completion request, ignoring whitespace and transport flags."""
+    normalized = {k: v for k, v in request_body.items() if k not in _UNKEYED_FIELDS}
+    normalized['messages'] = [
+        {'role': m['role'], 'content': ' '.join(str(m.get('content', '')).split())}
+        for m in request_body.get('messages', [])
+    ]
+    encoded = json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
@@ -0,0 +1,189 @@
+"""Shared, pooled HTTP clients for the upstream APIs (OpenRouter, SerpAPI).
+
+Every call through a client reuses keep-alive connections from a per-host
+pool instead of paying a fresh TCP+TLS handshake, retries 429/5xx answers
+with exponential backoff (honouring Retry-After), and applies that host's
+default timeouts. Each client counts requests and newly opened connections
+so connection reuse can be monitored.
+
+Completions are the exception: they are only retried on connection errors.
+A 500/502/504 may arrive after generation already ran (and was billed),
+and a 429/503 is left to the caller's UpstreamLimiter, which honours
+Retry-After without sleeping on a concurrency slot.
+
+Clients are configured from the environment, per upstream prefix:
+
+    <PREFIX>_POOL_SIZE        connections kept alive per host (default 10)
+    <PREFIX>_CONNECT_TIMEOUT  seconds to establish a connection
+    <PREFIX>_READ_TIMEOUT     seconds to wait for response data
+    <PREFIX>_RETRIES          retries on connection errors and 429/5xx
+    <PREFIX>_BACKOFF          backoff factor between retries, in seconds
+
+Set HTTP2_ENABLED=1 to negotiate HTTP/2 where the server supports it
+(uses urllib3's experimental HTTP/2 support and requires the h2 package).
+"""
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ConnectionStats:
+    """Thread-safe counters for requests sent and connections opened."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def as_dict(self):
+        with self._lock:
+            requests_sent = self.requests
+            opened = self.connections_opened
+        return {
+            "requests": requests_sent,
+            "connections_opened": opened,
+            "connections_reused": max(requests_sent - opened, 0),
+        }
+
+
+def _counting_pool(base, stats):
+    """Build a connection pool class that reports new connections to stats."""
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.record_connection()
+            return super()._new_conn()
+
+    CountingPool.__name__ = f"Counting{base.__name__}"
+    return CountingPool
+
+
+class CountingAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools count the connections they open."""
+
+    def __init__(self, stats, **kwargs):
+        # init_poolmanager runs inside HTTPAdapter.__init__
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.stats),
+            "https": _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+
+class HTTPClient:
+    """A keep-alive session with pooling, retries and default timeouts."""
+
+    def __init__(self, name, pool_size=10, connect_timeout=3.05, read_timeout=30,
+                 retries=2, backoff_factor=0.5, retry_methods=("GET",),
+                 retry_statuses=RETRY_STATUSES):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats = ConnectionStats()
+
+        retry = Retry(
+            total=retries,
+            # A read timeout means the upstream may still be working; retrying
+            # would only double the wait
+            read=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=retry_statuses,
+            allowed_methods=frozenset(retry_methods),
+            # urllib3 retries any 429/503 carrying Retry-After while this is
+            # on, whatever status_forcelist says
+            respect_retry_after_header=bool(retry_statuses),
+            # Hand the last 429/5xx back so callers still see the HTTP error
+            raise_on_status=False,
+        )
+        adapter = CountingAdapter(
+            self.stats,
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        self.stats.record_request()
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def client_from_env(name, prefix, **defaults):
+    """Create an HTTPClient from <PREFIX>_* environment variables."""
+    def setting(key, cast):
+        value = os.getenv(f"{prefix}_{key}")
+        return cast(value) if value is not None else defaults[key.lower()]
+
+    return HTTPClient(
+        name,
+        pool_size=setting("POOL_SIZE", int),
+        connect_timeout=setting("CONNECT_TIMEOUT", float),
+        read_timeout=setting("READ_TIMEOUT", float),
+        retries=setting("RETRIES", int),
+        backoff_factor=setting("BACKOFF", float),
+        retry_methods=defaults.get("retry_methods", ("GET",)),
+        retry_statuses=defaults.get("retry_statuses", RETRY_STATUSES),
+    )
+
+
+def enable_http2():
+    """Let urllib3 negotiate HTTP/2 via ALPN, if h2 is installed."""
+    try:
+        import urllib3.http2
+        urllib3.http2.inject_into_urllib3()
+        logger.info("HTTP/2 enabled for upstream clients")
+    except ImportError as e:
+        logger.warning(f"HTTP/2 requested but unavailable: {str(e)}")
+
+
+if os.getenv("HTTP2_ENABLED", "0") == "1":
+    enable_http2()
+
+openrouter_client = client_from_env(
+    "openrouter", "OPENROUTER",
+    pool_size=10, connect_timeout=3.05, read_timeout=30, retries=2, backoff=1.0,
+    # Only connection errors: see the module docstring
+    retry_methods=("POST",),
+    retry_statuses=(),
+)
+
+serpapi_client = client_from_env(
+    "serpapi", "SERPAPI",
+    pool_size=10, connect_timeout=3.05, read_timeout=10, retries=1, backoff=0.5,
+)
+
+
+def connection_stats():
+    """Connection reuse counters for every shared client."""
+    return {client.name: client.stats.as_dict() for client in (openrouter_client, serpapi_client)}
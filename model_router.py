@@ -0,0 +1,230 @@
+"""Route completions across a pool of models by observed latency and health.
+
+Models are configured as an ordered pool. Each keeps a rolling window of
+call latencies and outcomes; the router tries the fastest healthy model
+first (configured order until a model has enough samples), fires a backup
+request at the next model when the first is slower than its own p95
+(hedging), and falls back down the pool when a call fails. Short small-talk
+messages can be steered to a separate pool of cheap, fast models.
+
+Configure with OPENROUTER_MODELS and OPENROUTER_FAST_MODELS (comma-separated)
+and the MODEL_* variables read by router_from_env.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+def _quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class ModelStats:
+    """Recent latencies and outcomes of one model.
+
+    Outcomes older than health_window seconds are forgotten, so a model
+    marked unhealthy is probed again once its failures have aged out.
+    """
+
+    def __init__(self, window=50, health_window=60):
+        self.health_window = health_window
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, latency=None, ok=True):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        elif latency is not None:
+            self.latencies.append(latency)
+        self.outcomes.append((time.monotonic(), ok))
+
+    def error_rate(self):
+        horizon = time.monotonic() - self.health_window
+        recent = [ok for at, ok in self.outcomes if at >= horizon]
+        if not recent:
+            return 0.0, 0
+        return recent.count(False) / len(recent), len(recent)
+
+    def latency(self, q):
+        return _quantile(self.latencies, q) if self.latencies else None
+
+
+class ModelRouter:
+    """Pick, hedge and fall back between models for one upstream call.
+
+    `send(model)` performs the call for one model name and returns its
+    result, raising on failure. Exceptions of the `no_fallback` types (e.g.
+    our own admission control) do not count against the model and are
+    re-raised instead of falling back, unless another attempt is still in
+    flight: a hedge that was turned away just leaves the primary running.
+    """
+
+    def __init__(self, models, fast_models=(), window=50, min_samples=10,
+                 health_window=60, max_error_rate=0.5, hedge=True,
+                 hedge_quantile=0.95, hedge_after=10.0, min_hedge_after=1.0,
+                 executor=None, no_fallback=()):
+        if not models:
+            raise ValueError("ModelRouter needs at least one model")
+        self.models = list(models)
+        self.fast_models = [m for m in fast_models if m not in self.models]
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_after = hedge_after
+        self.min_hedge_after = min_hedge_after
+        self.no_fallback = tuple(no_fallback)
+        self.executor = executor or ThreadPoolExecutor(max_workers=16, thread_name_prefix='model-router')
+        self._lock = threading.Lock()
+        self._stats = {m: ModelStats(window, health_window) for m in self.models + self.fast_models}
+        self.counts = {'hedges': 0, 'hedge_wins': 0, 'primary_wins': 0, 'fallbacks': 0}
+
+    def record(self, model, latency=None, ok=True):
+        """Record one call's outcome; latency in seconds for successful calls."""
+        with self._lock:
+            self._stats[model].record(latency, ok)
+
+    def healthy(self, model):
+        with self._lock:
+            rate, samples = self._stats[model].error_rate()
+        return samples < 4 or rate < self.max_error_rate
+
+    def candidates(self, short=False):
+        """Models in the order to try them, fast pool first for short queries."""
+        def rank(pool):
+            def key(indexed):
+                index, model = indexed
+                with self._lock:
+                    stats = self._stats[model]
+                    p50 = stats.latency(0.5) if len(stats.latencies) >= self.min_samples else None
+                return (not self.healthy(model), p50 if p50 is not None else float('inf'), index)
+            return [model for _, model in sorted(enumerate(pool), key=key)]
+
+        if short and self.fast_models:
+            return rank(self.fast_models) + rank(self.models)
+        return rank(self.models)
+
+    def hedge_delay(self, model):
+        """Seconds to wait on `model` before firing a backup request."""
+        with self._lock:
+            stats = self._stats[model]
+            observed = stats.latency(self.hedge_quantile) if len(stats.latencies) >= self.min_samples else None
+        return max(observed if observed is not None else self.hedge_after, self.min_hedge_after)
+
+    def call(self, send, short=False, hedge=None, record_latency=True):
+        """Run send() against the pool; returns (model, result) of the first success.
+
+        Set hedge=False for calls whose losing attempt cannot simply be
+        discarded (e.g. an open stream), and record_latency=False when the
+        call's duration is not comparable to a full completion.
+        """
+        hedge = self.hedge if hedge is None else hedge
+        candidates = iter(self.candidates(short))
+        in_flight = {}
+        last_error = None
+
+        def attempt(model):
+            start = time.monotonic()
+            try:
+                result = send(model)
+            except self.no_fallback:
+                raise
+            except Exception:
+                self.record(model, ok=False)
+                raise
+            self.record(model, time.monotonic() - start if record_latency else None)
+            return result
+
+        def launch():
+            model = next(candidates, None)
+            if model is not None:
+                in_flight[self.executor.submit(attempt, model)] = model
+            return model
+
+        primary = launch()
+        hedge_at = time.monotonic() + self.hedge_delay(primary) if hedge else None
+        while in_flight:
+            timeout = max(hedge_at - time.monotonic(), 0) if hedge_at is not None else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # The primary is slower than usual: race it against the next model
+                hedge_at = None
+                if launch() is not None:
+                    self._count('hedges')
+                continue
+            for future in done:
+                model = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except self.no_fallback as e:
+                    if not in_flight:
+                        raise
+                    # A hedge turned away (e.g. no upstream slot) must not
+                    # fail the turn while the other attempt may still succeed
+                    last_error = e
+                    continue
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"Model {model} failed: {str(e)}")
+                    continue
+                if in_flight:
+                    # Won the race; the loser finishes in the background and
+                    # still feeds its model's latency stats
+                    self._count('hedge_wins' if model != primary else 'primary_wins')
+                return model, result
+            if not in_flight:
+                # Everything in flight failed; fall back to the next model
+                hedge_at = None
+                if launch() is None:
+                    break
+                self._count('fallbacks')
+        raise last_error
+
+    def stats(self):
+        """Per-model counters and latency quantiles (seconds), plus router counts."""
+        with self._lock:
+            models = {
+                model: {
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'p50': stats.latency(0.5),
+                    'p95': stats.latency(0.95),
+                }
+                for model, stats in self._stats.items()
+            }
+            counts = dict(self.counts)
+        return models, counts
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+
+def _model_list(value):
+    return [m.strip() for m in value.split(',') if m.strip()]
+
+
+def router_from_env(default_model, executor=None, no_fallback=()):
+    """Build a ModelRouter from OPENROUTER_MODELS, OPENROUTER_FAST_MODELS and MODEL_*."""
+    return ModelRouter(
+        _model_list(os.getenv('OPENROUTER_MODELS', default_model)),
+        fast_models=_model_list(os.getenv('OPENROUTER_FAST_MODELS', '')),
+        window=int(os.getenv('MODEL_STATS_WINDOW', '50')),
+        health_window=float(os.getenv('MODEL_HEALTH_WINDOW', '60')),
+        max_error_rate=float(os.getenv('MODEL_MAX_ERROR_RATE', '0.5')),
+        hedge=os.getenv('MODEL_HEDGE', '1') == '1',
+        hedge_quantile=float(os.getenv('MODEL_HEDGE_QUANTILE', '0.95')),
+        hedge_after=float(os.getenv('MODEL_HEDGE_AFTER', '10')),
+        min_hedge_after=float(os.getenv('MODEL_HEDGE_MIN_AFTER', '1')),
+        executor=executor,
+        no_fallback=no_fallback,
+    )
@@ -0,0 +1,276 @@
+"""Write-behind persistence for conversation rows.
+
+Rows are queued in memory and inserted by a background thread in batches
+(one bulk insert per batch), so a chat response never waits on Supabase.
+Failed batches are retried with exponential backoff and then spilled to a
+local JSON-lines journal, which is replayed once inserts succeed again and
+on the next start. The queue is flushed on interpreter shutdown.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import stat
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def private_state_dir(name='chatbot'):
+    """A directory under the temp dir that only this OS user can access.
+
+    Default home for local state (journals, session database, memory
+    index), which holds conversation text and session IDs. /tmp is shared,
+    so the directory is created mode 0700 and refused if someone else owns
+    it, it is a symlink, or other users can reach into it.
+    """
+    path = os.path.join(tempfile.gettempdir(), f'{name}-{os.getuid()}')
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(f"{path} is not a private directory owned by this user; "
+                           f"remove it or point the *_DIR / *_PATH settings elsewhere")
+    return path
+
+
+class WriteBehindQueue:
+    """Batches rows onto a bulk-insert callable from a background thread.
+
+    `insert_rows` receives a list of row dicts and must raise on failure.
+    Journals are named <journal_dir>/<name>-<pid>.jsonl; any worker may
+    replay any journal, claiming it first by renaming it to
+    <journal>.replay-<pid> while holding the journal's file lock, which
+    appends also take. Claims left behind by a worker that died mid-replay
+    are picked up again. Lines that don't parse (a crash mid-append) are
+    moved to <journal_dir>/<name>.corrupt instead of being replayed.
+    """
+
+    def __init__(self, insert_rows, name='rows', max_queue=10000, batch_size=50,
+                 flush_interval=0.2, retries=3, backoff=0.5, journal_dir=None,
+                 replay_interval=30):
+        self.insert_rows = insert_rows
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.journal_dir = journal_dir
+        self.replay_interval = replay_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._journal_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._last_replay = None
+        self.stats = {'queued': 0, 'written': 0, 'batches': 0, 'retries': 0, 'journaled': 0, 'replayed': 0,
+                      'corrupt': 0}
+        self._thread = threading.Thread(target=self._run, name=f'write-behind-{name}', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def journal_path(self):
+        if not self.journal_dir:
+            return None
+        return os.path.join(self.journal_dir, f'{self.name}-{os.getpid()}.jsonl')
+
+    def put(self, row, timeout=1.0):
+        """Queue a row; if the queue stays full, journal it instead."""
+        try:
+            self._queue.put(row, timeout=timeout)
+        except queue.Full:
+            logger.warning(f"Write-behind queue for {self.name} is full; journaling row")
+            self._journal([row])
+            return
+        self._count('queued')
+
+    def flush(self, timeout=None):
+        """Block until every queued row has been written or journaled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=10):
+        """Flush and stop the worker; called automatically at exit."""
+        if self._stopping.is_set():
+            return
+        self.flush(timeout)
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _run(self):
+        self._maybe_replay()
+        while not self._stopping.is_set():
+            try:
+                self._run_once()
+            except Exception:
+                # Never let one bad batch or journal stop the writer
+                logger.exception(f"Write-behind worker for {self.name} failed; continuing")
+
+    def _run_once(self):
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            self._maybe_replay()
+            return
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            if self._write(batch):
+                self._maybe_replay()
+            else:
+                self._journal(batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        """Insert a batch with retries; returns False if it never succeeded."""
+        for attempt in range(self.retries + 1):
+            try:
+                self.insert_rows(batch)
+                self._count('written', len(batch))
+                self._count('batches')
+                return True
+            except Exception as e:
+                logger.error(f"Write-behind insert of {len(batch)} {self.name} failed (attempt {attempt + 1}): {str(e)}")
+                if attempt < self.retries and not self._stopping.is_set():
+                    self._count('retries')
+                    time.sleep(self.backoff * (2 ** attempt))
+        return False
+
+    def _journal(self, rows):
+        path = self.journal_path
+        if path is None:
+            logger.error(f"Dropping {len(rows)} {self.name}: no journal configured")
+            return
+        with self._journal_lock:
+            while True:
+                with open(path, 'a', encoding='utf-8') as journal:
+                    fcntl.flock(journal, fcntl.LOCK_EX)
+                    # A replaying worker may have claimed (renamed) the file
+                    # while we waited for the lock; append to a fresh one
+                    try:
+                        if os.stat(path).st_ino != os.fstat(journal.fileno()).st_ino:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    for row in rows:
+                        journal.write(json.dumps(row) + '\n')
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                    break
+        self._count('journaled', len(rows))
+
+    def _maybe_replay(self):
+        now = time.monotonic()
+        if self._last_replay is None or now - self._last_replay >= self.replay_interval:
+            self._replay()
+
+    def _replay(self):
+        """Re-insert rows from every journal this worker can claim."""
+        self._last_replay = time.monotonic()
+        if not self.journal_dir:
+            return
+        claims = self._orphaned_claims()
+        for path in glob.glob(os.path.join(self.journal_dir, f'{self.name}-*.jsonl')):
+            claimed = self._claim(path)
+            if claimed:
+                claims.append(claimed)
+        for claimed in claims:
+            try:
+                self._replay_file(claimed)
+            except Exception:
+                # The claim stays on disk and is retried on the next replay
+                logger.exception(f"Replaying {claimed} failed")
+
+    def _claim(self, path):
+        """Rename a journal to this worker's claim name, or None if busy or gone."""
+        claimed = f'{path}.replay-{os.getpid()}'
+        try:
+            with self._journal_lock, open(path, encoding='utf-8') as journal:
+                try:
+                    # Its owner holds the lock while appending
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+                os.rename(path, claimed)
+        except OSError:
+            # Another worker got there first
+            return None
+        return claimed
+
+    def _orphaned_claims(self):
+        """Claims left by dead workers (or an earlier failed replay here), re-claimed."""
+        claims = []
+        for path in glob.glob(os.path.join(self.journal_dir, f'{self.name}-*.jsonl.replay-*')):
+            journal, _, pid = path.rpartition('.replay-')
+            if not pid.isdigit():
+                continue
+            if int(pid) == os.getpid():
+                claims.append(path)
+                continue
+            try:
+                os.kill(int(pid), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                # Alive, owned by another user
+                continue
+            claimed = f'{journal}.replay-{os.getpid()}'
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            claims.append(claimed)
+        return claims
+
+    def _replay_file(self, claimed):
+        rows = []
+        corrupt = []
+        with open(claimed, encoding='utf-8') as journal:
+            for line in journal:
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    corrupt.append(line if line.endswith('\n') else line + '\n')
+        if corrupt:
+            logger.error(f"Quarantining {len(corrupt)} unreadable lines from {claimed}")
+            with open(os.path.join(self.journal_dir, f'{self.name}.corrupt'), 'a', encoding='utf-8') as f:
+                f.writelines(corrupt)
+            self._count('corrupt', len(corrupt))
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            if self._write(batch):
+                self._count('replayed', len(batch))
+            else:
+                self._journal(rows[start:])
+                break
+        os.remove(claimed)
@@ -0,0 +1,244 @@
+"""Assemble the messages sent to the model within a token budget.
+
+The prompt always carries the system instructions, any query-specific
+formatting instructions, what we know about the user, the summary of
+compacted older history and the new message with its search context.
+Past exchanges recalled from retrieval memory get up to memory_budget
+tokens of what is left, and recent history fills the rest, newest first;
+stale search context embedded in older user turns is trimmed before whole
+turns are dropped. Upstream latency and cost scale with input
+tokens, so the budget (PROMPT_TOKEN_BUDGET) bounds both.
+"""
+import math
+import re
+
+SYSTEM_PROMPT = """You are a helpful, friendly assistant that remembers information about the user throughout the conversation.
+
+Important instructions for formatting responses:
+1. Always structure your responses in a clean, easy-to-read format
+2. Use bullet points (•) or numbered lists when listing multiple items
+3. Use appropriate spacing and line breaks for readability
+4. For data or statistics, present them in a clear, structured way
+5. Use appropriate emphasis with bold or italics markers when needed
+6. When sharing weather or time-sensitive information, highlight the key details
+7. Break down complex information into digestible sections
+
+Important instructions for personalization:
+1. Remember and use the user's name if they share it
+2. Remember personal preferences and context from previous conversations
+3. If providing real-time data (weather, news, etc.), highlight the most relevant information first
+4. If you need to correct or clarify something, do so politely
+5. Keep your tone friendly and conversational while maintaining professionalism
+
+When formatting responses:
+• For weather: Start with current conditions, then forecast
+• For lists: Use bullet points and clear categories
+• For explanations: Use short paragraphs with clear headings
+• For data: Present in a structured, easy-to-read format
+• For instructions: Use numbered steps
+
+Keep your responses concise but informative, and always prioritize clarity."""
+
+WEATHER_PROMPT = """Format weather information in a clean, structured way:
+• Start with current conditions
+• Show temperature with both °C and °F
+• Highlight important weather alerts or changes
+• Use bullet points for hourly breakdowns
+• Put severe weather warnings in a separate section"""
+
+LIST_PROMPT = """You are a concise and clear assistant. Format your responses following these rules:
+
+1. Keep responses brief and focused
+   • Limit lists to 5 items maximum
+   • One key point per item
+   • No lengthy explanations
+
+2. Use Simple Formatting
+   • Numbered steps for instructions
+   • Short, clear sentences
+   • No special characters or markers
+   • No repetition
+
+For bullet point lists:
+• Start each item with a bullet point (•)
+• Include a space after the bullet point
+• Keep items aligned and properly indented
+• Use sub-bullets for nested items
+
+For headings and sections:
+- Use clear, descriptive headings
+- Add a blank line before and after headings
+- Group related information under each heading
+- Use consistent formatting throughout
+
+Formatting rules:
+- Never use asterisks (*) for formatting
+- Use proper spacing and line breaks
+- Keep paragraphs short and focused
+- Use clear, simple language"""
+
+# Roughly what chat formats add around each message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Enrichment that older rows have baked into stored user turns
+_CONTEXT_SUFFIX_RE = re.compile(r"\n\nContext: .*\Z", re.DOTALL)
+_PROFILE_PREFIX_RE = re.compile(r"\APrevious context: .*?\n\nCurrent message: ", re.DOTALL)
+
+
+def estimate_tokens(text):
+    """Estimate BPE tokens: one per punctuation mark, one per ~4 word characters."""
+    return sum(math.ceil(len(token) / 4) for token in _TOKEN_RE.findall(text))
+
+
+def message_tokens(message):
+    return estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def strip_enrichment(content):
+    """Remove search and profile context embedded in a stored user turn."""
+    return _PROFILE_PREFIX_RE.sub('', _CONTEXT_SUFFIX_RE.sub('', content))
+
+
+def query_prompt(user_message):
+    """Extra formatting instructions for weather and list-type questions."""
+    lowered = user_message.lower()
+    if "weather" in lowered:
+        return WEATHER_PROMPT
+    if any(word in lowered for word in ["list", "steps", "how to", "guide"]):
+        return LIST_PROMPT
+    return None
+
+
+def profile_context(stored_info):
+    """Describe stored user information for the model, or None."""
+    if not stored_info:
+        return None
+    context = "Previous context: "
+    if 'name' in stored_info:
+        context += f"The user's name is {stored_info['name']}. "
+    return context.strip()
+
+
+def summary_context(summary):
+    """Present the rolling summary of compacted history, or None."""
+    if not summary:
+        return None
+    return f"Summary of your earlier conversation with this user: {summary}"
+
+
+def memory_context(memories):
+    """Present recalled exchanges (dicts with user/assistant text), or None."""
+    if not memories:
+        return None
+    lines = ["Relevant earlier exchanges with this user, for reference:"]
+    for memory in memories:
+        lines.append(f"- User: {memory['user']}\n  Assistant: {memory['assistant']}")
+    return '\n'.join(lines)
+
+
+def user_turn(user_message, search_context=None):
+    """The new user message with its search results appended."""
+    if search_context:
+        return f"{user_message}\n\nContext: {search_context}"
+    return user_message
+
+
+class PromptBuilder:
+    """Fits system prompts, context, history and the new message to a budget."""
+
+    def __init__(self, token_budget=3000, max_history_turns=10, summary_budget=400, memory_budget=500):
+        self.token_budget = token_budget
+        self.max_history_turns = max_history_turns
+        self.summary_budget = summary_budget
+        self.memory_budget = memory_budget
+
+    def build(self, user_message, history=(), stored_info=None, search_context=None, summary=None, memories=()):
+        """Return (messages, estimated prompt tokens).
+
+        `history` holds previous turns, oldest first, as role/content dicts;
+        `summary` covers the turns before them. `memories` are recalled
+        exchanges, best first.
+        """
+        system = [{"role": "system", "content": SYSTEM_PROMPT}]
+        extra = query_prompt(user_message)
+        if extra:
+            system.append({"role": "system", "content": extra})
+        profile = profile_context(stored_info)
+        if profile:
+            system.append({"role": "system", "content": profile})
+        if summary:
+            if estimate_tokens(summary) > self.summary_budget:
+                summary = self._truncate(summary, self.summary_budget)
+            system.append({"role": "system", "content": summary_context(summary)})
+
+        fixed_tokens = sum(message_tokens(m) for m in system)
+        current = {"role": "user", "content": user_turn(user_message, search_context)}
+        current_tokens = message_tokens(current)
+
+        # Search context is the only fixed part that can grow without bound
+        if search_context and fixed_tokens + current_tokens > self.token_budget:
+            allowance = self.token_budget - fixed_tokens - message_tokens({"content": user_turn(user_message)})
+            search_context = self._truncate(search_context, max(allowance - 2, 0))
+            current = {"role": "user", "content": user_turn(user_message, search_context)}
+            current_tokens = message_tokens(current)
+
+        available = self.token_budget - fixed_tokens - current_tokens
+        memory = self._fit_memories(memories, min(self.memory_budget, available))
+        if memory:
+            system.append(memory)
+            memory_tokens = message_tokens(memory)
+            fixed_tokens += memory_tokens
+            available -= memory_tokens
+
+        turns = self._fit_history(list(history)[-self.max_history_turns:] if self.max_history_turns else [],
+                                  available)
+        messages = system + [turn for turn, _ in turns] + [current]
+        total = fixed_tokens + current_tokens + sum(tokens for _, tokens in turns)
+        return messages, total
+
+    @staticmethod
+    def _fit_memories(memories, available):
+        """The memory message for as many recalled exchanges as fit, or None."""
+        message = None
+        for count in range(1, len(memories) + 1):
+            candidate = {"role": "system", "content": memory_context(memories[:count])}
+            if message_tokens(candidate) > available:
+                break
+            message = candidate
+        return message
+
+    def _fit_history(self, turns, available):
+        """Pick the history that fits `available` tokens, trimming oldest first."""
+        fitted = [(turn, message_tokens(turn)) for turn in turns]
+        total = sum(tokens for _, tokens in fitted)
+
+        # First drop stale search context, oldest turns first
+        for i, (turn, tokens) in enumerate(fitted):
+            if total <= available:
+                break
+            if turn['role'] != 'user':
+                continue
+            stripped = {"role": "user", "content": strip_enrichment(turn['content'])}
+            stripped_tokens = message_tokens(stripped)
+            fitted[i] = (stripped, stripped_tokens)
+            total -= tokens - stripped_tokens
+
+        # Then drop whole turns, oldest first
+        while fitted and total > available:
+            total -= fitted.pop(0)[1]
+        return fitted
+
+    @staticmethod
+    def _truncate(text, max_tokens):
+        """Cut text to roughly max_tokens, at a word boundary."""
+        kept = []
+        used = 0
+        for word in text.split(' '):
+            cost = estimate_tokens(word)
+            if used + cost > max_tokens:
+                break
+            kept.append(word)
+            used += cost
+        return ' '.join(kept)
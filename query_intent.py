@@ -0,0 +1,121 @@
+"""Decide whether a chat message needs a web search before the LLM call.
+
+A search costs a SerpAPI round trip (and quota) on the critical path, so
+messages are gated through a classifier. Classifiers are plain callables
+taking the message and returning a score; the gate searches when the score
+reaches its threshold. Pick one with SEARCH_CLASSIFIER (``scored``,
+``keywords``, ``always`` or ``never``) and tune it with SEARCH_THRESHOLD.
+"""
+import os
+import re
+import threading
+
+QUESTION_WORDS = ("who", "what", "when", "where", "how", "why")
+
+SMALL_TALK_WORDS = ("hi", "hii", "hello", "hey", "thanks", "thank you", "bye", "how are you",
+                    "good morning", "good night", "what's up", "whats up")
+
+
+def _cue(words):
+    """Compile a case-insensitive, word-boundary pattern matching any of words."""
+    return re.compile(r"\b(?:" + "|".join(re.escape(w) for w in words) + r")\b", re.IGNORECASE)
+
+
+class KeywordClassifier:
+    """The original keyword trigger, matched on whole words only.
+
+    Scores 1.0 when any trigger word appears as a word, so "show" or
+    "somewhat" no longer count as "how" and "what".
+    """
+
+    def __init__(self, words=QUESTION_WORDS + ("current", "latest")):
+        self.pattern = _cue(words)
+
+    def __call__(self, message):
+        return 1.0 if self.pattern.search(message) else 0.0
+
+
+class ScoredClassifier:
+    """Sums weighted cues that suggest the answer needs fresh, external facts.
+
+    Question words alone are weak evidence; time-sensitive or live-data terms
+    are strong; small talk and questions about the user themself count
+    against searching, since the model or the stored profile answers those.
+    """
+
+    DEFAULT_CUES = (
+        (_cue(QUESTION_WORDS), 0.5),
+        (_cue(("current", "currently", "latest", "recent", "recently", "today", "tonight",
+               "tomorrow", "yesterday", "now", "news", "this week", "this year", "update")), 1.0),
+        (_cue(("weather", "forecast", "temperature", "price", "prices", "stock", "score",
+               "scores", "exchange rate", "election", "release date", "schedule")), 1.0),
+        (re.compile(r"\b(?:19|20)\d{2}\b"), 0.5),
+        (re.compile(r"\?\s*$"), 0.25),
+        (_cue(SMALL_TALK_WORDS), -1.0),
+        (_cue(("my name", "about me", "remember me", "who am i", "you", "your")), -0.75),
+    )
+
+    def __init__(self, cues=None):
+        self.cues = cues if cues is not None else self.DEFAULT_CUES
+
+    def __call__(self, message):
+        return sum(weight for pattern, weight in self.cues if pattern.search(message))
+
+
+# Words that may accompany a greeting without turning it into a request
+PLEASANTRY_WORDS = ("there", "again", "all", "everyone", "so much", "very much", "a lot", "ok", "okay",
+                    "cool", "great", "nice", "thx", "ty", "yo", "cheers", "goodbye", "good evening",
+                    "good afternoon", "see you", "later", "doing", "today", "you", "too")
+
+# The whole message, not just part of it, is greetings and punctuation
+_SMALL_TALK = re.compile(
+    r"^\W*(?:(?:" + "|".join(re.escape(w) for w in SMALL_TALK_WORDS + PLEASANTRY_WORDS) + r")\b\W*)+$",
+    re.IGNORECASE,
+)
+
+
+def is_small_talk(message, max_words=8):
+    """True for short messages made only of greetings and pleasantries."""
+    return len(message.split()) <= max_words and bool(_SMALL_TALK.match(message))
+
+
+CLASSIFIERS = {
+    "scored": ScoredClassifier,
+    "keywords": KeywordClassifier,
+    "always": lambda: (lambda message: 1.0),
+    "never": lambda: (lambda message: 0.0),
+}
+
+
+class SearchGate:
+    """Applies a classifier and a threshold, and counts the decisions."""
+
+    def __init__(self, classifier, threshold=0.5):
+        self.classifier = classifier
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.counts = {"searched": 0, "skipped": 0, "forced": 0, "suppressed": 0}
+
+    def should_search(self, message, override=None):
+        """Decide for one message; override=True/False bypasses the classifier."""
+        if override is not None:
+            decision = "forced" if override else "suppressed"
+            result = bool(override)
+        else:
+            result = self.classifier(message) >= self.threshold
+            decision = "searched" if result else "skipped"
+        with self._lock:
+            self.counts[decision] += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def gate_from_env():
+    """Build the SearchGate selected by SEARCH_CLASSIFIER and SEARCH_THRESHOLD."""
+    name = os.getenv("SEARCH_CLASSIFIER", "scored")
+    if name not in CLASSIFIERS:
+        raise ValueError(f"Unknown SEARCH_CLASSIFIER {name!r}; expected one of {', '.join(CLASSIFIERS)}")
+    return SearchGate(CLASSIFIERS[name](), threshold=float(os.getenv("SEARCH_THRESHOLD", "0.5")))
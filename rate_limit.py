@@ -0,0 +1,149 @@
+"""Admission control: per-user token buckets and upstream concurrency limits.
+
+UserRateLimiter stops one user from monopolizing the worker pool.
+UpstreamLimiter bounds in-flight calls to an upstream API, queues callers
+for at most max_wait seconds, and backs off for as long as the upstream's
+Retry-After asks once it starts throttling us.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+
+class AdmissionError(Exception):
+    """A call was not admitted; retry_after is a hint in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, default=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class UserRateLimiter:
+    """A token bucket per user: `rate` requests per second, bursts up to `burst`.
+
+    Buckets for the least recently seen users are dropped past max_users; a
+    dropped bucket comes back full, which only ever errs towards admitting.
+    """
+
+    def __init__(self, rate=0.5, burst=5, max_users=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, user_id):
+        """Take a token for user_id; returns (allowed, seconds until the next token)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(user_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.rejected += 1
+            self._buckets[user_id] = (tokens, now)
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        retry_after = 0.0 if allowed else (1 - tokens) / self.rate
+        return allowed, retry_after
+
+
+class UpstreamLimiter:
+    """Caps concurrent calls to one upstream and honours its throttling."""
+
+    def __init__(self, name, max_concurrent=8, max_wait=5.0):
+        self.name = name
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self.in_flight = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def acquire(self):
+        """Wait up to max_wait for a slot, raising AdmissionError if none frees up.
+
+        Returns a release callable that is safe to call more than once, for
+        slots held past the function that took them (streamed responses).
+        """
+        deadline = time.monotonic() + self.max_wait
+        with self._lock:
+            blocked_until = self._blocked_until
+        # Upstream asked us to back off: wait it out if we can, else fail fast
+        backoff = blocked_until - time.monotonic()
+        if backoff > 0:
+            if backoff > self.max_wait:
+                self._reject()
+                raise AdmissionError(f"{self.name} is rate limiting requests", retry_after=backoff)
+            time.sleep(backoff)
+        if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            self._reject()
+            raise AdmissionError(f"Too many requests in flight to {self.name}", retry_after=1.0)
+        with self._lock:
+            self.in_flight += 1
+
+        released = []
+        def release():
+            with self._lock:
+                if released:
+                    return
+                released.append(True)
+                self.in_flight -= 1
+            self._slots.release()
+        return release
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the duration of a with block."""
+        release = self.acquire()
+        try:
+            yield
+        finally:
+            release()
+
+    def throttle(self, seconds):
+        """Hold off new calls for `seconds`, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self.throttled += 1
+
+    def observe(self, response, default_backoff=1.0):
+        """Back off if an upstream response says we are being throttled."""
+        if response.status_code == 429 or (response.status_code == 503 and 'Retry-After' in response.headers):
+            self.throttle(parse_retry_after(response.headers.get('Retry-After'), default_backoff))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'rejected': self.rejected,
+                'throttled': self.throttled,
+            }
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
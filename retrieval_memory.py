@@ -0,0 +1,241 @@
+"""Long-term recall of past exchanges through local hashed TF-IDF vectors.
+
+Every completed exchange (a user message and the reply to it) is embedded
+on the CPU with the hashing trick: word unigrams and bigrams are hashed
+into a fixed number of signed buckets holding sublinear term frequencies.
+No model is downloaded and vectors never need re-fitting. IDF weights come
+from each user's own index at query time, so recall adapts to what a user
+talks about.
+
+Each user's index is a directory under `root` holding vectors.f16 (raw
+float16 rows, memory-mapped for search) and meta.jsonl (one line per row).
+Rows are only ever appended, under an exclusive file lock, so several
+worker processes can share one index directory.
+
+The IDF weights and weighted row norms depend on the whole index, so they
+are computed once per index version and cached with it; add() refreshes
+them in the background. A query then only reads the columns of the
+buckets its own (sparse) embedding touches.
+"""
+import fcntl
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by can could did do does for from had has have he her him his how i i'm
+if in into is it it's its just me my of on or our she so some than that the their them then there
+these they this to too up us was we were what when where which who why will with would you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercased words without stop words."""
+    return [w for w in _WORD_RE.findall(text.lower()) if w not in STOP_WORDS]
+
+
+class HashingEmbedder:
+    """Embed text as signed, hashed unigram and bigram term frequencies."""
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def embed(self, text):
+        words = tokenize(text)
+        features = Counter(words)
+        features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in features.items():
+            # crc32 is stable across processes, unlike hash()
+            h = zlib.crc32(feature.encode('utf-8'))
+            vector[h % self.dim] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + math.log(count))
+        return vector
+
+
+class _UserIndex:
+    """One user's rows, with the vectors memory-mapped read-only."""
+
+    def __init__(self, vectors, meta, meta_size):
+        self.vectors = vectors
+        self.meta = meta
+        # Another process appended rows once meta.jsonl has grown past this
+        self.meta_size = meta_size
+        # (rows searched, idf, weighted row norms), filled in by _weights
+        self.weights = None
+
+
+class RetrievalMemory:
+    """Per-user vector indexes of past exchanges with top-k search.
+
+    `exclude_recent` skips the newest exchanges, which the prompt already
+    carries as history; matches scoring below `min_score` are ignored.
+    Indexes beyond max_rows are rewritten keeping the newest rows.
+    """
+
+    def __init__(self, root, dim=1024, max_rows=5000, max_open=64,
+                 exclude_recent=5, min_score=0.15, max_chars=1000):
+        self.root = root
+        self.embedder = HashingEmbedder(dim)
+        self.dim = dim
+        self.max_rows = max_rows
+        self.max_open = max_open
+        self.exclude_recent = exclude_recent
+        self.min_score = min_score
+        self.max_chars = max_chars
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'indexed': 0, 'searches': 0, 'recalled': 0}
+        os.makedirs(root, exist_ok=True)
+
+    def add(self, user_id, user_message, reply, timestamp=None):
+        """Index one exchange for a user."""
+        vector = self.embedder.embed(f"{user_message}\n{reply}").astype(np.float16)
+        meta = json.dumps({
+            'user': user_message[:self.max_chars],
+            'assistant': reply[:self.max_chars],
+            'timestamp': timestamp,
+        })
+        directory = self._directory(user_id)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            rows = self._row_count(directory)
+            # A crash between the two appends leaves a vector without
+            # metadata; overwrite it rather than misalign every later row
+            with open(os.path.join(directory, 'vectors.f16'), 'r+b' if rows is not None else 'wb') as f:
+                f.seek((rows or 0) * self.dim * 2)
+                f.write(vector.tobytes())
+                f.truncate()
+            with open(os.path.join(directory, 'meta.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(meta + '\n')
+            if (rows or 0) + 1 > self.max_rows * 1.25:
+                self._trim(directory)
+        with self._lock:
+            self._open.pop(user_id, None)
+            self.stats['indexed'] += 1
+        # Callers index off the request path; pay for the weights here
+        index = self._load(user_id)
+        if index is not None:
+            self._weights(index)
+
+    def search(self, user_id, query, k=3):
+        """Top-k past exchanges for query, best first, as dicts with a score."""
+        with self._lock:
+            self.stats['searches'] += 1
+        index = self._load(user_id)
+        if index is None:
+            return []
+        weights = self._weights(index)
+        if weights is None:
+            return []
+        n, idf, norms = weights
+        q = self.embedder.embed(query) * idf
+        q_norm = np.linalg.norm(q)
+        if not q_norm:
+            return []
+        # (doc * idf) . (query * idf), over the buckets the query uses
+        columns = np.flatnonzero(q)
+        dots = np.asarray(index.vectors[:n, columns], dtype=np.float32) @ (q[columns] * idf[columns])
+        scores = dots / (norms * q_norm)
+
+        top = np.argsort(-scores)[:k]
+        results = [dict(index.meta[i], score=float(scores[i])) for i in top if scores[i] >= self.min_score]
+        with self._lock:
+            self.stats['recalled'] += len(results)
+        return results
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _weights(self, index, chunk=1024):
+        """(rows searched, smoothed IDF, weighted row norms) for an index, cached on it."""
+        if index.weights is not None:
+            return index.weights
+        n = len(index.meta) - self.exclude_recent
+        if n <= 0:
+            return None
+        # In chunks, so the float16 map is never copied whole
+        df = np.zeros(self.dim, dtype=np.int64)
+        for start in range(0, n, chunk):
+            df += np.count_nonzero(index.vectors[start:min(start + chunk, n)], axis=0)
+        idf = (np.log((1 + n) / (1 + df)) + 1.0).astype(np.float32)
+        norms = np.empty(n, dtype=np.float32)
+        for start in range(0, n, chunk):
+            block = np.asarray(index.vectors[start:min(start + chunk, n)], dtype=np.float32)
+            norms[start:start + len(block)] = np.sqrt(np.square(block) @ np.square(idf))
+        norms[norms == 0] = 1.0
+        index.weights = (n, idf, norms)
+        return index.weights
+
+    def _directory(self, user_id):
+        return os.path.join(self.root, hashlib.sha256(str(user_id).encode('utf-8')).hexdigest()[:32])
+
+    def _row_count(self, directory):
+        """Rows with both a vector and metadata, or None for a new index."""
+        path = os.path.join(directory, 'vectors.f16')
+        if not os.path.exists(path):
+            return None
+        vectors = os.path.getsize(path) // (self.dim * 2)
+        try:
+            with open(os.path.join(directory, 'meta.jsonl'), 'rb') as f:
+                lines = sum(1 for _ in f)
+        except FileNotFoundError:
+            lines = 0
+        return min(vectors, lines)
+
+    def _load(self, user_id):
+        directory = self._directory(user_id)
+        meta_path = os.path.join(directory, 'meta.jsonl')
+        try:
+            meta_size = os.path.getsize(meta_path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            index = self._open.get(user_id)
+            if index is not None and index.meta_size == meta_size:
+                self._open.move_to_end(user_id)
+                return index
+
+        with open(os.path.join(directory, 'lock'), 'w') as lock:
+            # Shared, so reads never see a half-finished trim
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            with open(meta_path, encoding='utf-8') as f:
+                meta = [json.loads(line) for line in f if line.endswith('\n')]
+                meta_size = f.tell()
+            rows = min(len(meta), os.path.getsize(os.path.join(directory, 'vectors.f16')) // (self.dim * 2))
+            if not rows:
+                return None
+            vectors = np.memmap(os.path.join(directory, 'vectors.f16'), dtype=np.float16, mode='r', shape=(rows, self.dim))
+        index = _UserIndex(vectors, meta[:rows], meta_size)
+
+        with self._lock:
+            self._open[user_id] = index
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return index
+
+    def _trim(self, directory):
+        """Keep the newest max_rows rows; called with the index lock held."""
+        vectors_path = os.path.join(directory, 'vectors.f16')
+        meta_path = os.path.join(directory, 'meta.jsonl')
+        with open(meta_path, encoding='utf-8') as f:
+            meta = f.readlines()
+        rows = min(len(meta), os.path.getsize(vectors_path) // (self.dim * 2))
+        start = rows - self.max_rows
+        vectors = np.fromfile(vectors_path, dtype=np.float16, count=rows * self.dim).reshape(rows, self.dim)
+        vectors[start:].tofile(vectors_path + '.tmp')
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.writelines(meta[start:rows])
+        # Readers holding the old maps keep the old inodes
+        os.replace(vectors_path + '.tmp', vectors_path)
+        os.replace(meta_path + '.tmp', meta_path)
@@ -0,0 +1,232 @@
+"""Server-side sessions: the cookie carries only a random session ID.
+
+Flask's default session signs the whole session into the cookie, so every
+request re-verifies an HMAC and every worker must share FLASK_SECRET_KEY.
+Here the session data stays in a backend and the cookie is a 128-bit
+random ID, so looking up the logged-in user is a local dictionary or
+SQLite read.
+
+Backends:
+  memory  an LRU dict in this process; only correct with a single worker
+  sqlite  a SQLite file shared by every worker on the host
+
+Sessions expire `ttl` seconds after their last use. Expiry is pushed back
+at most once per `refresh_after` seconds, so an active user costs one
+backend write per interval rather than one per request. Expired sessions
+are deleted in bulk every `purge_interval` seconds.
+"""
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import MISSING, SQLiteStore
+from persistence import private_state_dir
+
+logger = logging.getLogger(__name__)
+
+# secrets.token_urlsafe(16): 16 random bytes as 22 URL-safe characters
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{22}$")
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data loaded from a backend under `sid`.
+
+    Clearing the session (as login and logout do) gives it a fresh ID when
+    it is saved, so an ID seen before login is never authenticated.
+    """
+
+    def __init__(self, initial=None, sid=None, remaining=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.remaining = remaining
+        self.new = sid is None
+        self.modified = False
+        self.rotate = False
+
+    def clear(self):
+        super().clear()
+        self.rotate = True
+
+
+class MemorySessionBackend:
+    """Sessions in a process-local LRU dict, evicted past max_sessions."""
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        """Return (data, seconds left) for a live session, or MISSING."""
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return MISSING
+            data, expires_at = entry
+            remaining = expires_at - time.time()
+            if remaining <= 0:
+                del self._entries[sid]
+                return MISSING
+            self._entries.move_to_end(sid)
+            return dict(data), remaining
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._entries[sid] = (dict(data), time.time() + ttl)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._entries.items() if expires_at <= now]
+            for sid in expired:
+                del self._entries[sid]
+        return len(expired)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteSessionBackend(SQLiteStore):
+    """Sessions in a SQLite file shared by every worker on the host.
+
+    Session IDs are bearer credentials, so the file is created readable by
+    this OS user only; SQLite gives its -wal/-shm files the same mode.
+    """
+
+    def __init__(self, path):
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(path, 0o600)
+        super().__init__(path, table='sessions')
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface storing session data in `backend`."""
+
+    def __init__(self, backend, ttl=7 * 24 * 3600, refresh_after=300, purge_interval=3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + purge_interval
+        self._lock = threading.Lock()
+        self.stats = {'loaded': 0, 'missed': 0, 'created': 0, 'refreshed': 0, 'deleted': 0, 'purged': 0}
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or not _SESSION_ID_RE.match(sid):
+            return ServerSession()
+        entry = self.backend.get(sid)
+        if entry is MISSING:
+            self._count('missed')
+            return ServerSession()
+        self._count('loaded')
+        data, remaining = entry
+        return ServerSession(data, sid=sid, remaining=remaining)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if not session:
+            if session.sid is not None and session.modified:
+                self.backend.delete(session.sid)
+                self._count('deleted')
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        if session.sid is not None and session.rotate:
+            self.backend.delete(session.sid)
+            session.sid = None
+        if session.sid is None:
+            session.sid = new_session_id()
+            self._count('created')
+        elif not session.modified:
+            if session.remaining > self.ttl - self.refresh_after:
+                # Expiry was pushed back recently enough
+                return
+            self._count('refreshed')
+
+        self.backend.set(session.sid, dict(session), self.ttl)
+        response.set_cookie(name, session.sid, max_age=self.ttl, domain=domain, path=path,
+                            secure=secure, samesite=samesite, httponly=httponly)
+        self._maybe_purge()
+
+    def purge_expired(self):
+        """Delete every expired session; returns how many were removed."""
+        purged = self.backend.purge_expired()
+        self._count('purged', purged)
+        return purged
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _maybe_purge(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        try:
+            self.purge_expired()
+        except Exception:
+            logger.exception("Purging expired sessions failed")
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+
+BACKENDS = ('cookie', 'memory', 'sqlite')
+
+
+def session_interface_from_env():
+    """Build the session interface selected by SESSION_BACKEND.
+
+    Returns None for 'cookie', which keeps Flask's signed cookie sessions.
+    That stays the default on Vercel, where instances share no local disk.
+    """
+    name = os.getenv('SESSION_BACKEND', 'cookie' if os.getenv('VERCEL') else 'sqlite')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown SESSION_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+    if name == 'cookie':
+        return None
+    if name == 'memory':
+        backend = MemorySessionBackend(max_sessions=int(os.getenv('SESSION_MAX_ENTRIES', '10000')))
+    else:
+        backend = SQLiteSessionBackend(
+            os.getenv('SESSION_DB_PATH') or os.path.join(private_state_dir(), 'sessions.sqlite3')
+        )
+    return ServerSessionInterface(
+        backend,
+        ttl=int(os.getenv('SESSION_TTL', str(7 * 24 * 3600))),
+        refresh_after=int(os.getenv('SESSION_REFRESH_AFTER', '300')),
+        purge_interval=int(os.getenv('SESSION_PURGE_INTERVAL', '3600')),
+    )
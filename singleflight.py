@@ -0,0 +1,74 @@
+"""Collapse concurrent identical upstream calls into one.
+
+When several requests need the same result at the same moment (a trending
+question searched by many users at once), only the first caller, the
+leader, makes the upstream call; the others wait for it and share its
+result or its exception. Callers that would wait longer than max_wait make
+their own call instead, so one slow request cannot stall the rest.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicate in-flight calls by key.
+
+    `normalize`, if given, maps a key to the form that decides which calls
+    are identical (e.g. a search query with case and punctuation removed).
+    """
+
+    def __init__(self, normalize=None, max_wait=None):
+        self.normalize = normalize
+        self.max_wait = max_wait
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'shared': 0, 'timeouts': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) once per key at a time.
+
+        Returns (result, shared), where shared is True when the result came
+        from another caller's call.
+        """
+        if self.normalize:
+            key = self.normalize(key)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['leaders'] += 1
+
+        if not leader:
+            if not call.done.wait(self.max_wait):
+                self._count('timeouts')
+                return fn(*args, **kwargs), False
+            self._count('shared')
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
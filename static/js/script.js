@@ -3,9 +3,11 @@ document.addEventListener('DOMContentLoaded', function() {
     const userInput = document.getElementById('user-input');
     const chatMessages = document.getElementById('chat-messages');
     let isProcessing = false;
+    let historyCursor = null;
+    let isLoadingHistory = false;
 
-    // Function to add a message to the chat
-    function addMessage(content, isUser = false, isThinking = false, isError = false) {
+    // Build a message element without inserting it
+    function createMessage(content, isUser = false, isThinking = false, isError = false) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${isUser ? 'user' : isError ? 'error' : 'bot'}`;
         
@@ -29,6 +31,12 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         
         messageDiv.appendChild(messageContent);
+        return messageDiv;
+    }
+
+    // Function to add a message to the chat
+    function addMessage(content, isUser = false, isThinking = false, isError = false) {
+        const messageDiv = createMessage(content, isUser, isThinking, isError);
         chatMessages.appendChild(messageDiv);
         
         // Scroll to the bottom
@@ -36,6 +44,43 @@ document.addEventListener('DOMContentLoaded', function() {
         return messageDiv;
     }
 
+    // Load one page of older messages and put it above the current ones.
+    // Returns the number of messages loaded.
+    async function loadHistory() {
+        if (isLoadingHistory) return 0;
+        isLoadingHistory = true;
+        try {
+            const url = historyCursor ? `/history?before=${encodeURIComponent(historyCursor)}` : '/history';
+            const response = await fetch(url, { credentials: 'include' });
+            if (!response.ok) return 0;
+            const data = await response.json();
+
+            // Keep the visible messages where they are while the page grows above them
+            const previousHeight = chatMessages.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            data.messages.forEach(function(message) {
+                fragment.appendChild(createMessage(message.content, message.role === 'user'));
+            });
+            chatMessages.insertBefore(fragment, chatMessages.firstChild);
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+
+            historyCursor = data.next_cursor;
+            return data.messages.length;
+        } catch (error) {
+            console.error('Error loading history:', error);
+            return 0;
+        } finally {
+            isLoadingHistory = false;
+        }
+    }
+
+    // Fetch older messages when scrolled near the top
+    chatMessages.addEventListener('scroll', function() {
+        if (historyCursor && chatMessages.scrollTop < 100) {
+            loadHistory();
+        }
+    });
+
     // Remove thinking message
     function removeThinking() {
         const thinkingMsg = chatMessages.querySelector('[data-thinking="true"]');
@@ -44,6 +89,38 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Read a Server-Sent Events response, calling onEvent(event, data) per event
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(function(line) {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                });
+                if (data) {
+                    onEvent(event, JSON.parse(data));
+                }
+            }
+        }
+    }
+
     // Handle form submission
     chatForm.addEventListener('submit', async function(e) {
         e.preventDefault();
@@ -67,10 +144,11 @@ document.addEventListener('DOMContentLoaded', function() {
         const thinkingMsg = addMessage('', false, true);
 
         try {
-            const response = await fetch('/chat', {
+            const response = await fetch('/chat/stream', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
                 },
                 credentials: 'include',  // This is important for cookies
                 body: JSON.stringify({ message: message })
@@ -82,18 +160,65 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
 
-            const data = await response.json();
-            
-            // Remove thinking message
-            thinkingMsg.remove();
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!response.ok || !contentType.includes('text/event-stream') || !response.body) {
+                const data = await response.json();
 
-            if (response.ok) {
-                // Add bot response to chat
-                addMessage(data.response);
-            } else {
-                // Add error message with specific error if available
-                const errorMessage = data.error || 'Sorry, I encountered an error. Please try again.';
-                addMessage(errorMessage, false, false, true);
+                // Remove thinking message
+                thinkingMsg.remove();
+
+                if (response.ok) {
+                    addMessage(data.response);
+                } else {
+                    // Add error message with specific error if available
+                    const errorMessage = data.error || 'Sorry, I encountered an error. Please try again.';
+                    addMessage(errorMessage, false, false, true);
+                }
+                return;
+            }
+
+            // Render tokens as they arrive: formatted sections followed by the raw tail
+            let botMsg = null;
+            let sections = [];
+            let pending = '';
+
+            function render() {
+                if (!botMsg) {
+                    thinkingMsg.remove();
+                    botMsg = addMessage('');
+                }
+                const parts = pending ? sections.concat([pending]) : sections;
+                botMsg.querySelector('.message-content').textContent = parts.join('\n\n');
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            }
+
+            await readEventStream(response, function(event, data) {
+                if (event === 'delta') {
+                    pending += data.content;
+                    render();
+                } else if (event === 'section') {
+                    sections.push(data.content);
+                    pending = data.pending;
+                    render();
+                } else if (event === 'done') {
+                    sections = [data.response];
+                    pending = '';
+                    render();
+                } else if (event === 'error') {
+                    if (botMsg) {
+                        botMsg.remove();
+                    } else {
+                        thinkingMsg.remove();
+                    }
+                    botMsg = null;
+                    addMessage(data.error || 'Sorry, I encountered an error. Please try again.', false, false, true);
+                }
+            });
+
+            // The stream ended before producing anything
+            if (thinkingMsg.isConnected) {
+                thinkingMsg.remove();
+                addMessage('Sorry, I encountered an error. Please try again.', false, false, true);
             }
         } catch (error) {
             // Remove thinking message
@@ -109,6 +234,12 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    // Add initial greeting
-    addMessage('Hello! How can I help you today?');
+    // Show the latest messages, or the initial greeting for a new conversation
+    loadHistory().then(function(loaded) {
+        if (loaded) {
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        } else {
+            addMessage('Hello! How can I help you today?');
+        }
+    });
 });
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""Compact old conversation turns into a rolling per-user summary.
+
+History reads only ever look at the most recent turns, so everything older
+is invisible to the model while still costing storage and index time. The
+compactor folds those older turns into a short summary kept on the user's
+user_info row (summary, summarized_through), then archives the raw rows to
+conversations_archive (or deletes them) so a user's live history stays a
+constant size. The prompt builder injects the summary in place of the
+history it replaces.
+
+Users are marked as they chat and compacted by a background thread every
+`interval` seconds; `flask --app app compact-history` compacts every user.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an assistant.
+Merge the previous summary (if any) with the new turns into one updated summary.
+Keep facts about the user, their preferences, decisions made and open questions.
+Drop greetings, pleasantries and details of answers that are unlikely to matter again.
+Write at most 150 words of plain prose in the third person, with no preamble."""
+
+
+def parse_timestamp(value):
+    """Parse a timestamp as returned by PostgREST; raises ValueError."""
+    # Postgres may return fewer than six fractional digits, which
+    # fromisoformat only accepts from Python 3.11
+    if '.' in value:
+        head, _, tail = value.partition('.')
+        digits = len(tail) - len(tail.lstrip('0123456789'))
+        tail = tail[:digits].ljust(6, '0')[:6] + tail[digits:]
+        value = f"{head}.{tail}"
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def summary_messages(previous_summary, turns):
+    """The prompt asking a model to fold `turns` into `previous_summary`."""
+    transcript = '\n'.join(f"{turn['role'].capitalize()}: {turn['content']}" for turn in turns)
+    parts = []
+    if previous_summary:
+        parts.append(f"Previous summary:\n{previous_summary}")
+    parts.append(f"New turns:\n{transcript}")
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": '\n\n'.join(parts)},
+    ]
+
+
+class ConversationCompactor:
+    """Summarizes and archives conversation rows beyond the newest keep_turns.
+
+    `get_client()` returns the Supabase client and `summarize(messages)`
+    returns the model's reply to summary_messages(); `on_summary(user_id,
+    summary)`, if given, is called after a summary is stored. A user is compacted
+    once at least min_turns rows have fallen out of the kept window, at
+    most batch_size rows at a time. The summary update is conditional on
+    summarized_through, so two workers compacting the same user cannot
+    both fold in (and delete) the same rows.
+    """
+
+    def __init__(self, get_client, summarize, keep_turns=10, min_turns=10,
+                 batch_size=200, archive=True, interval=300, on_summary=None):
+        self.get_client = get_client
+        self.summarize = summarize
+        self.on_summary = on_summary
+        self.keep_turns = keep_turns
+        self.min_turns = min_turns
+        self.batch_size = batch_size
+        self.archive = archive
+        self.interval = interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'users': 0, 'rows': 0, 'conflicts': 0, 'errors': 0}
+
+    def mark(self, user_id):
+        """Note that a user has new turns and may need compacting."""
+        with self._lock:
+            self._pending.add(user_id)
+
+    def start(self):
+        """Start the background thread, once."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='history-compactor', daemon=True)
+                self._thread.start()
+
+    def compact_pending(self):
+        """Compact every marked user; returns the number of rows compacted."""
+        with self._lock:
+            users, self._pending = self._pending, set()
+        return sum(self._compact_logged(user_id) for user_id in users)
+
+    def compact_all(self, page_size=500):
+        """Compact every user in the users table, a page at a time."""
+        compacted = 0
+        start = 0
+        while True:
+            page = self.get_client().table('users').select('id').order('id').range(start, start + page_size - 1).execute().data
+            compacted += sum(self._compact_logged(row['id']) for row in page)
+            if len(page) < page_size:
+                return compacted
+            start += page_size
+
+    def compact_user(self, user_id):
+        """Fold this user's turns beyond the kept window into their summary.
+
+        Turns are folded oldest first, batch_size at a time, so the summary
+        always covers a contiguous prefix of the history ending at
+        summarized_through. Returns the number of rows summarized and
+        archived.
+        """
+        client = self.get_client()
+        # The newest row outside the kept window; it and everything older may go
+        cutoff = client.table('conversations').select('timestamp', 'id').eq('user_id', user_id) \
+            .order('timestamp', desc=True).order('id', desc=True) \
+            .range(self.keep_turns, self.keep_turns).execute().data
+        if not cutoff:
+            return 0
+        cutoff = cutoff[0]
+
+        compacted = 0
+        while True:
+            batch = self._compact_batch(client, user_id, cutoff)
+            if not batch:
+                return compacted
+            compacted += batch
+
+    def _compact_batch(self, client, user_id, cutoff):
+        """Summarize and archive the oldest batch of rows up to cutoff."""
+        result = client.table('user_info').select('summary', 'summarized_through').eq('user_id', user_id).execute()
+        current = result.data[0] if result.data else None
+        through = current and current['summarized_through']
+
+        timestamp, row_id = cutoff['timestamp'], cutoff['id']
+        # One extra row shows whether the batch ends inside a run of equal timestamps
+        rows = client.table('conversations').select('*').eq('user_id', user_id) \
+            .or_(f'timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lte.{row_id})') \
+            .order('timestamp').order('id').limit(self.batch_size + 1).execute().data
+        if len(rows) > self.batch_size:
+            following = rows.pop()
+            # summarized_through is a timestamp, so never split rows sharing one
+            while len(rows) > 1 and rows[-1]['timestamp'] == following['timestamp']:
+                rows.pop()
+        # Rows a previous run summarized but failed to archive are only archived now
+        done = [row for row in rows if through and parse_timestamp(row['timestamp']) <= parse_timestamp(through)]
+        turns = rows[len(done):]
+        if len(turns) < self.min_turns:
+            turns = []
+        if not done and not turns:
+            return 0
+
+        if turns:
+            previous_summary = current['summary'] if current else None
+            summary = self.summarize(summary_messages(previous_summary, turns)).strip()
+            if not summary:
+                raise ValueError("Empty summary from model")
+
+            update = {'summary': summary, 'summarized_through': turns[-1]['timestamp']}
+            if current is None:
+                client.table('user_info').upsert({'user_id': user_id, 'info': '{}', **update},
+                                                 on_conflict='user_id').execute()
+            else:
+                query = client.table('user_info').update(update).eq('user_id', user_id)
+                if through is None:
+                    query = query.is_('summarized_through', 'null')
+                else:
+                    query = query.eq('summarized_through', through)
+                if not query.execute().data:
+                    # Another worker compacted this user first
+                    self._count('conflicts')
+                    return 0
+            if self.on_summary:
+                self.on_summary(user_id, summary)
+
+        rows = done + turns
+        if self.archive:
+            client.table('conversations_archive').upsert(rows, on_conflict='id').execute()
+        client.table('conversations').delete().in_('id', [row['id'] for row in rows]).execute()
+        self._count('users')
+        self._count('rows', len(rows))
+        logger.info(f"Compacted {len(rows)} turns for user {str(user_id)[:8]}")
+        return len(rows)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _compact_logged(self, user_id):
+        try:
+            return self.compact_user(user_id)
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Error compacting history for user {str(user_id)[:8]}: {str(e)}")
+            return 0
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.compact_pending()
@@ -0,0 +1,35 @@
+-- Profiles are written with `upsert ... on conflict (user_id)`, which needs
+-- a unique index on user_id. The old select-then-insert path could race and
+-- leave several rows for one user. No column records when a row was written,
+-- so none of them can be called the newest: their `info` objects (JSON text,
+-- as the app writes it) are merged into one surviving row instead. Where two
+-- rows set the same key to different values, either value may win.
+create temporary table user_info_merged as
+select d.user_id,
+       d.keep,
+       coalesce((select jsonb_object_agg(kv.key, kv.value)
+                 from user_info u,
+                      jsonb_each(coalesce(nullif(u.info, ''), '{}')::jsonb) kv
+                 where u.user_id = d.user_id), '{}'::jsonb)::text as info
+from (
+    select user_id, (array_agg(ctid))[1] as keep
+    from user_info
+    where user_id is not null
+    group by user_id
+    having count(*) > 1
+) d;
+
+update user_info u
+    set info = m.info
+    from user_info_merged m
+    where u.ctid = m.keep;
+
+delete from user_info u
+    using user_info_merged m
+    where u.user_id = m.user_id
+      and u.ctid <> m.keep;
+
+drop table user_info_merged;
+
+create unique index if not exists user_info_user_id_key
+    on user_info (user_id);
@@ -0,0 +1,11 @@
+-- Keep per-turn enrichment (search results) out of the message text.
+-- `content` holds only what the user or assistant actually said; `context`
+-- holds the zlib-compressed, base64-encoded enrichment used for that turn
+-- and is cleared once `context_expires_at` has passed.
+alter table conversations
+    add column if not exists context text,
+    add column if not exists context_expires_at timestamptz;
+
+create index if not exists conversations_context_expires_at_idx
+    on conversations (context_expires_at)
+    where context_expires_at is not null;
@@ -0,0 +1,19 @@
+-- Rolling per-user summaries of compacted conversation history.
+-- `summary` replaces the turns older than the live window in the prompt;
+-- `summarized_through` is the timestamp of the newest turn folded into it
+-- and doubles as the version checked by concurrent compactors.
+alter table user_info
+    add column if not exists summary text,
+    add column if not exists summarized_through timestamptz;
+
+-- Raw turns removed from `conversations` once summarized.
+create table if not exists conversations_archive (
+    like conversations including defaults including constraints including indexes
+);
+
+alter table conversations_archive
+    add column if not exists archived_at timestamptz not null default now();
+
+-- History reads and compaction both walk a user's turns newest first.
+create index if not exists conversations_user_id_timestamp_idx
+    on conversations (user_id, timestamp desc, id desc);
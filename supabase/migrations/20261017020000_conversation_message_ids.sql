@@ -0,0 +1,11 @@
+-- Client-generated key for each conversation row. A batch insert can commit
+-- and still report an error (e.g. a read timeout), after which the app
+-- retries or replays it; inserts skip rows whose message_id already exists.
+alter table conversations
+    add column if not exists message_id uuid;
+
+alter table conversations_archive
+    add column if not exists message_id uuid;
+
+create unique index if not exists conversations_message_id_key
+    on conversations (message_id);
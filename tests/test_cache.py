@@ -0,0 +1,49 @@
+from cache import ConversationCache
+
+
+def turn(role, content):
+    return {'role': role, 'content': content}
+
+
+def test_read_overtaken_by_a_save_is_not_cached():
+    cache = ConversationCache(turns_per_user=10)
+    generation = cache.generation('u')
+    # The user-message save lands while the cold read is in flight
+    cache.append('u', turn('user', 'first'))
+    cache.load('u', [], complete=True, generation=generation)
+    assert cache.get('u', 5) is None
+
+    generation = cache.generation('u')
+    cache.load('u', [turn('user', 'first')], complete=True, generation=generation)
+    cache.append('u', turn('assistant', 'reply'))
+    assert cache.get('u', 5) == [turn('user', 'first'), turn('assistant', 'reply')]
+
+
+def test_generation_survives_forgetting_idle_users():
+    cache = ConversationCache(turns_per_user=10, max_users=2)
+    cache.append('a', turn('user', 'x'))
+    generation = cache.generation('a')
+    cache.append('a', turn('user', 'y'))
+    # Enough other users to push 'a' out of the generation table
+    for user in 'bcdefg':
+        cache.append(user, turn('user', 'x'))
+    cache.load('a', [], complete=True, generation=generation)
+    assert cache.get('a', 5) is None
+
+
+def test_saves_to_other_users_do_not_invalidate_a_read():
+    cache = ConversationCache(turns_per_user=10)
+    generation = cache.generation('u')
+    cache.append('someone-else', turn('user', 'x'))
+    cache.load('u', [turn('user', 'hi')], complete=True, generation=generation)
+    assert cache.get('u', 5) == [turn('user', 'hi')]
+
+
+def test_appends_to_a_warm_user_are_served():
+    cache = ConversationCache(turns_per_user=3)
+    cache.load('u', [turn('user', 'a'), turn('assistant', 'b')], complete=True)
+    cache.append('u', turn('user', 'c'))
+    cache.append('u', turn('assistant', 'd'))
+    assert [t['content'] for t in cache.get('u', 3)] == ['b', 'c', 'd']
+    # The oldest turn was dropped, so a longer read must go to the database
+    assert cache.get('u', 4) is None
@@ -0,0 +1,29 @@
+import time
+
+import pytest
+
+import http_clients
+from fake_services import FakeServices, ServiceProfile
+
+
+@pytest.fixture
+def throttled_services():
+    profile = ServiceProfile(error_rate=1.0, error_status=429)
+    with FakeServices(openrouter=profile, serpapi=ServiceProfile(error_rate=1.0, error_status=502)) as services:
+        yield services
+
+
+def test_completion_429_is_returned_without_sleeping(throttled_services):
+    start = time.monotonic()
+    response = http_clients.openrouter_client.post(throttled_services.env()['OPENROUTER_URL'], json={'messages': []})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert time.monotonic() - start < 0.5
+    assert throttled_services.requests['openrouter'] == 1
+
+
+def test_get_is_retried_on_5xx(throttled_services):
+    client = http_clients.HTTPClient('test', retries=1, backoff_factor=0)
+    response = client.get(throttled_services.env()['SERPAPI_URL'], params={'q': 'x'})
+    assert response.status_code == 502
+    assert throttled_services.requests['serpapi'] == 2
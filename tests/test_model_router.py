@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from model_router import ModelRouter
+from rate_limit import AdmissionError
+
+
+def make_router(models, **kwargs):
+    kwargs.setdefault('hedge_after', 0.05)
+    kwargs.setdefault('min_hedge_after', 0.05)
+    return ModelRouter(models, no_fallback=(AdmissionError,), **kwargs)
+
+
+def test_rejected_hedge_keeps_waiting_for_primary():
+    def send(model):
+        if model == 'a':
+            time.sleep(0.3)
+            return 'from a'
+        raise AdmissionError("no slot", retry_after=1)
+
+    router = make_router(['a', 'b'])
+    assert router.call(send) == ('a', 'from a')
+    models, _ = router.stats()
+    assert models['b']['errors'] == 0
+
+
+def test_admission_error_without_other_attempts_is_raised():
+    calls = []
+
+    def send(model):
+        calls.append(model)
+        raise AdmissionError("no slot", retry_after=1)
+
+    with pytest.raises(AdmissionError):
+        make_router(['a', 'b'], hedge=False).call(send)
+    assert calls == ['a']
+
+
+def test_failure_falls_back_to_next_model():
+    def send(model):
+        if model == 'a':
+            raise RuntimeError("boom")
+        return model
+
+    router = make_router(['a', 'b'], hedge=False)
+    assert router.call(send) == ('b', 'b')
+    _, counts = router.stats()
+    assert counts['fallbacks'] == 1
+
+
+def test_slow_primary_is_hedged():
+    def send(model):
+        if model == 'a':
+            time.sleep(0.5)
+        return model
+
+    router = make_router(['a', 'b'])
+    assert router.call(send) == ('b', 'b')
+    _, counts = router.stats()
+    assert counts['hedges'] == 1
+    assert counts['hedge_wins'] == 1
+
+
+def test_candidates_follow_config_until_enough_samples():
+    router = make_router(['a', 'b', 'c'], min_samples=3)
+    for _ in range(2):
+        router.record('c', 0.1)
+    assert router.candidates() == ['a', 'b', 'c']
+    router.record('c', 0.1)
+    for _ in range(3):
+        router.record('a', 1.0)
+    assert router.candidates() == ['c', 'a', 'b']
+
+
+def test_unhealthy_models_are_tried_last():
+    router = make_router(['a', 'b'], min_samples=1)
+    for _ in range(4):
+        router.record('a', ok=False)
+    assert not router.healthy('a')
+    assert router.candidates() == ['b', 'a']
+
+
+def test_short_queries_try_the_fast_pool_first():
+    router = make_router(['big'], fast_models=['small'])
+    assert router.candidates(short=True) == ['small', 'big']
+    assert router.candidates() == ['big']
+
+
+def test_hedge_delay_tracks_observed_latency():
+    router = make_router(['a'], min_samples=5, hedge_after=10, min_hedge_after=0.1)
+    assert router.hedge_delay('a') == 10
+    for latency in (0.2, 0.3, 0.4, 0.5, 2.0):
+        router.record('a', latency)
+    assert router.hedge_delay('a') == 2.0
@@ -0,0 +1,108 @@
+import fcntl
+import time
+
+import pytest
+from supabase import create_client
+
+from fake_services import FakeServices
+from persistence import WriteBehindQueue
+
+
+@pytest.fixture
+def services():
+    with FakeServices() as services:
+        yield services
+
+
+@pytest.fixture
+def supabase(services):
+    env = services.env()
+    return create_client(env['SUPABASE_URL'], env['SUPABASE_KEY'])
+
+
+def test_retried_batch_that_committed_is_not_duplicated(supabase, tmp_path):
+    attempts = []
+
+    def insert_rows(rows):
+        supabase.table('conversations').upsert(
+            rows, on_conflict='message_id', ignore_duplicates=True, default_to_null=False
+        ).execute()
+        attempts.append(len(rows))
+        if len(attempts) == 1:
+            raise TimeoutError("committed, but the response was lost")
+
+    writer = WriteBehindQueue(insert_rows, journal_dir=str(tmp_path), backoff=0)
+    writer.put({'message_id': 'm-1', 'user_id': 'u', 'role': 'user', 'content': 'hi'})
+    assert writer.flush(5)
+    writer.close()
+
+    assert len(attempts) == 2
+    rows = supabase.table('conversations').select('*').execute().data
+    assert [row['message_id'] for row in rows] == ['m-1']
+
+
+def make_writer(tmp_path, insert_rows, **kwargs):
+    kwargs.setdefault('backoff', 0)
+    return WriteBehindQueue(insert_rows, journal_dir=str(tmp_path), **kwargs)
+
+
+def test_truncated_journal_line_is_quarantined(tmp_path):
+    (tmp_path / 'rows-999999.jsonl').write_text('{"a": 1}\n{"b": ')
+    written = []
+    writer = make_writer(tmp_path, written.extend)
+    writer.put({'c': 3})
+    assert writer.flush(5)
+    writer.close()
+
+    assert {'a': 1} in written and {'c': 3} in written
+    assert (tmp_path / 'rows.corrupt').read_text() == '{"b": \n'
+    assert writer.snapshot()['corrupt'] == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['rows.corrupt']
+
+
+def test_claim_left_by_dead_worker_is_replayed(tmp_path):
+    # PIDs this high are never handed out on Linux (pid_max <= 2**22)
+    (tmp_path / 'rows-999998.jsonl.replay-99999999').write_text('{"a": 1}\n')
+    written = []
+    writer = make_writer(tmp_path, written.extend)
+    assert writer.flush(5)
+    writer.close()
+
+    assert written == [{'a': 1}]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_journal_being_appended_is_not_claimed(tmp_path):
+    path = tmp_path / 'rows-1.jsonl'
+    path.write_text('{"a": 1}\n')
+    written = []
+    with open(path, 'a') as journal:
+        fcntl.flock(journal, fcntl.LOCK_EX)
+        writer = make_writer(tmp_path, written.extend, replay_interval=0.05)
+        time.sleep(0.3)
+        assert written == []
+        assert path.exists()
+        fcntl.flock(journal, fcntl.LOCK_UN)
+    deadline = time.monotonic() + 5
+    while not written and time.monotonic() < deadline:
+        time.sleep(0.05)
+    writer.close()
+    assert written == [{'a': 1}]
+
+
+def test_worker_survives_a_failing_journal(tmp_path):
+    written = []
+
+    def insert_rows(rows):
+        if rows[0].get('fail'):
+            raise RuntimeError("database down")
+        written.extend(rows)
+
+    writer = make_writer(tmp_path, insert_rows, retries=0)
+    writer._journal = lambda rows: 1 / 0
+    writer.put({'fail': True})
+    assert writer.flush(5)
+    writer.put({'ok': True})
+    assert writer.flush(5)
+    writer.close()
+    assert written == [{'ok': True}]
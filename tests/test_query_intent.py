@@ -0,0 +1,22 @@
+import pytest
+
+from query_intent import is_small_talk
+
+
+@pytest.mark.parametrize('message', [
+    "hi", "Hello!", "hey there :)", "thanks so much!!", "thank you", "how are you?",
+    "hi, how are you doing today?", "good morning everyone", "ok thanks, bye",
+])
+def test_pleasantries_are_small_talk(message):
+    assert is_small_talk(message)
+
+
+@pytest.mark.parametrize('message', [
+    "hi, explain quantum entanglement in detail please",
+    "thanks! now write me a python web scraper",
+    "hey how do I reverse a linked list",
+    "what is the weather",
+    "hello " * 10,
+])
+def test_requests_are_not_small_talk(message):
+    assert not is_small_talk(message)
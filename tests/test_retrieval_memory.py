@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from retrieval_memory import RetrievalMemory
+
+EXCHANGES = [
+    ("my dog is called biscuit", "what a lovely name for a dog"),
+    ("I am learning rust programming", "rust has a strict borrow checker"),
+    ("planning a trip to lisbon in may", "lisbon is lovely in spring"),
+    ("how do I bake sourdough bread", "start with an active sourdough starter"),
+    ("recommend a sci-fi novel", "try the left hand of darkness"),
+]
+
+
+@pytest.fixture
+def memory(tmp_path):
+    memory = RetrievalMemory(str(tmp_path), dim=256, exclude_recent=0, min_score=0.0)
+    for user_message, reply in EXCHANGES:
+        memory.add('u', user_message, reply)
+    return memory
+
+
+def naive_scores(memory, user_id, query):
+    index = memory._load(user_id)
+    docs = np.asarray(index.vectors, dtype=np.float32)
+    idf = np.log((1 + len(docs)) / (1 + np.count_nonzero(docs, axis=0))) + 1.0
+    weighted = docs * idf
+    q = memory.embedder.embed(query) * idf
+    return (weighted @ q) / (np.linalg.norm(weighted, axis=1) * np.linalg.norm(q))
+
+
+def test_search_matches_full_idf_cosine(memory):
+    query = "what was my dog called"
+    expected = naive_scores(memory, 'u', query)
+    results = memory.search('u', query, k=len(EXCHANGES))
+    assert results[0]['user'] == EXCHANGES[0][0]
+    by_message = {row['user']: row['score'] for row in results}
+    for i, (user_message, _) in enumerate(EXCHANGES):
+        if user_message in by_message:
+            assert by_message[user_message] == pytest.approx(expected[i], rel=1e-3)
+
+
+def test_weights_are_cached_until_the_index_grows(memory, tmp_path):
+    memory.search('u', "sourdough")
+    index = memory._load('u')
+    assert index.weights is not None
+    assert memory._load('u') is index
+
+    # Another worker appends to the same directory
+    RetrievalMemory(str(tmp_path), dim=256).add('u', "sourdough hydration levels", "aim for about 75 percent")
+    reloaded = memory._load('u')
+    assert reloaded is not index
+    assert reloaded.weights is None
+    assert memory.search('u', "sourdough hydration")[0]['user'] == "sourdough hydration levels"
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import pytest
+
+from persistence import private_state_dir
+from session_store import SQLiteSessionBackend
+
+
+@pytest.fixture
+def temp_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    return tmp_path
+
+
+def test_private_state_dir_is_owner_only(temp_root):
+    path = private_state_dir()
+    assert os.stat(path).st_mode & 0o777 == 0o700
+    assert private_state_dir() == path
+
+
+def test_private_state_dir_refuses_shared_directory(temp_root):
+    path = temp_root / f'chatbot-{os.getuid()}'
+    path.mkdir(mode=0o777)
+    os.chmod(path, 0o777)
+    with pytest.raises(RuntimeError):
+        private_state_dir()
+
+
+def test_private_state_dir_refuses_symlink(temp_root):
+    (temp_root / 'elsewhere').mkdir(mode=0o700)
+    os.symlink(temp_root / 'elsewhere', temp_root / f'chatbot-{os.getuid()}')
+    with pytest.raises(RuntimeError):
+        private_state_dir()
+
+
+def test_session_database_is_owner_only(tmp_path):
+    path = tmp_path / 'sessions.sqlite3'
+    path.touch(mode=0o644)
+    backend = SQLiteSessionBackend(str(path))
+    backend.set('sid', {'user_id': 'u'}, 60)
+    for name in os.listdir(tmp_path):
+        assert os.stat(tmp_path / name).st_mode & 0o777 == 0o600, name
@@ -0,0 +1,84 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cache import normalize_query
+from singleflight import SingleFlight
+
+
+def run_concurrently(flight, keys, fn):
+    with ThreadPoolExecutor(len(keys)) as pool:
+        futures = [pool.submit(flight.do, key, fn, key) for key in keys]
+        return [future.result() for future in futures]
+
+
+def slow_echo(calls, delay=0.2):
+    lock = threading.Lock()
+
+    def fn(key):
+        with lock:
+            calls.append(key)
+        time.sleep(delay)
+        return key.upper()
+    return fn
+
+
+def test_concurrent_identical_calls_share_one_result():
+    calls = []
+    flight = SingleFlight()
+    results = run_concurrently(flight, ['q'] * 5, slow_echo(calls))
+    assert calls == ['q']
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert {result for result, _ in results} == {'Q'}
+    assert flight.snapshot() == {'leaders': 1, 'shared': 4, 'timeouts': 0}
+
+
+def test_normalized_keys_are_coalesced():
+    calls = []
+    flight = SingleFlight(normalize=normalize_query)
+    run_concurrently(flight, ['Weather in Paris?', 'weather in paris'], slow_echo(calls))
+    assert len(calls) == 1
+
+
+def test_different_keys_run_separately():
+    calls = []
+    run_concurrently(SingleFlight(), ['a', 'b'], slow_echo(calls))
+    assert sorted(calls) == ['a', 'b']
+
+
+def test_followers_receive_the_leaders_exception():
+    started = threading.Event()
+
+    def fail(key):
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("upstream down")
+
+    flight = SingleFlight()
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(flight.do, 'q', fail, 'q')
+        started.wait()
+        follower = pool.submit(flight.do, 'q', fail, 'q')
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert flight.snapshot()['shared'] == 1
+
+
+def test_follower_past_max_wait_makes_its_own_call():
+    calls = []
+    flight = SingleFlight(max_wait=0.05)
+    results = run_concurrently(flight, ['q', 'q'], slow_echo(calls, delay=0.3))
+    assert calls == ['q', 'q']
+    assert [shared for _, shared in results] == [False, False]
+    assert flight.snapshot()['timeouts'] == 1
+
+
+def test_key_is_released_after_the_call():
+    calls = []
+    flight = SingleFlight()
+    flight.do('q', slow_echo(calls, delay=0), 'q')
+    flight.do('q', slow_echo(calls, delay=0), 'q')
+    assert calls == ['q', 'q']
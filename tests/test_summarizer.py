@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from supabase import create_client
+
+from fake_services import FakeServices
+from summarizer import ConversationCompactor
+
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def supabase():
+    with FakeServices() as services:
+        env = services.env()
+        yield create_client(env['SUPABASE_URL'], env['SUPABASE_KEY'])
+
+
+def seed(supabase, count, summarized_through=None, timestamp=lambda i: BASE + timedelta(seconds=i)):
+    supabase.table('user_info').insert({
+        'user_id': 'u', 'info': '{}', 'summary': 'earlier' if summarized_through else None,
+        'summarized_through': summarized_through,
+    }).execute()
+    supabase.table('conversations').insert([
+        {'user_id': 'u', 'role': 'user', 'content': f'turn {i}', 'timestamp': timestamp(i).isoformat()}
+        for i in range(count)
+    ]).execute()
+
+
+class RecordingSummarizer:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, messages):
+        transcript = messages[-1]['content'].split('New turns:\n')[1]
+        self.batches.append([line.split(': ', 1)[1] for line in transcript.splitlines()])
+        return f"summary through {self.batches[-1][-1]}"
+
+
+def live_turns(supabase):
+    rows = supabase.table('conversations').select('content').order('timestamp').order('id').execute().data
+    return [row['content'] for row in rows]
+
+
+def test_every_old_turn_is_summarized_oldest_first(supabase):
+    seed(supabase, 50)
+    summarize = RecordingSummarizer()
+    compactor = ConversationCompactor(lambda: supabase, summarize, keep_turns=10, min_turns=10, batch_size=10)
+
+    assert compactor.compact_user('u') == 40
+    assert [batch[0] for batch in summarize.batches] == ['turn 0', 'turn 10', 'turn 20', 'turn 30']
+    assert sum(len(batch) for batch in summarize.batches) == 40
+    assert live_turns(supabase) == [f'turn {i}' for i in range(40, 50)]
+    assert len(supabase.table('conversations_archive').select('id').execute().data) == 40
+    info = supabase.table('user_info').select('*').execute().data[0]
+    assert info['summary'] == 'summary through turn 39'
+    assert compactor.compact_user('u') == 0
+
+
+def test_batches_never_split_equal_timestamps(supabase):
+    # Turns 8-12 share one timestamp
+    seed(supabase, 30, timestamp=lambda i: BASE + timedelta(seconds=8 if 8 <= i <= 12 else i))
+    summarize = RecordingSummarizer()
+    compactor = ConversationCompactor(lambda: supabase, summarize, keep_turns=10, min_turns=1, batch_size=10)
+
+    assert compactor.compact_user('u') == 20
+    assert summarize.batches[0] == [f'turn {i}' for i in range(8)]
+    assert summarize.batches[1][0] == 'turn 8'
+
+
+def test_rows_summarized_earlier_are_archived_without_resummarizing(supabase):
+    # A previous run folded in turns 0-4 but failed before archiving them
+    seed(supabase, 25, summarized_through=(BASE + timedelta(seconds=4)).isoformat())
+    summarize = RecordingSummarizer()
+    compactor = ConversationCompactor(lambda: supabase, summarize, keep_turns=10, min_turns=5, batch_size=50)
+
+    assert compactor.compact_user('u') == 15
+    assert summarize.batches == [[f'turn {i}' for i in range(5, 15)]]
+    assert live_turns(supabase) == [f'turn {i}' for i in range(15, 25)]
+
+
+def test_too_few_old_turns_are_left_alone(supabase):
+    seed(supabase, 14)
+    summarize = RecordingSummarizer()
+    compactor = ConversationCompactor(lambda: supabase, summarize, keep_turns=10, min_turns=5, batch_size=50)
+
+    assert compactor.compact_user('u') == 0
+    assert summarize.batches == []
+    assert len(live_turns(supabase)) == 14
@@ -0,0 +1,183 @@
+"""Post-processing of model replies and extraction of user facts.
+
+Replies are cleaned, formatted and (for list-type answers) truncated in a
+single pass over their lines by ResponseFormatter, which can also be fed a
+reply incrementally as it streams in. Patterns are compiled once at import.
+Benchmarks live in benchmarks/bench_text_processing.py.
+"""
+import re
+
+# List markers counted towards the truncation limit
+LIST_ITEM_PREFIXES = ('1.', '2.', '3.', '4.', '5.', '•')
+
+# Markers whose presence makes a reply a list-type response
+LIST_START_PREFIXES = ('1.', '•')
+
+MORE_ITEMS_NOTE = "Let me know if you'd like more suggestions."
+
+# Intro lines with this many words or more are formatted like body text
+GREETING_MAX_WORDS = 15
+
+NAME_PATTERNS = [re.compile(p) for p in (
+    r"(?i)my name is (\w+)",
+    r"(?i)i am (\w+)",
+    r"(?i)i'm (\w+)",
+    r"(?i)call me (\w+)",
+)]
+
+
+def clean_text(text):
+    """Collapse whitespace and strip markdown emphasis markers."""
+    text = ' '.join(text.split())
+    if '*' in text or '#' in text:
+        text = text.replace('###', '')
+        text = text.replace('**', '')
+        text = text.replace('*.', '•')
+        text = text.replace('•*', '•')
+        text = text.replace('*', '')
+    return text.strip()
+
+
+def format_line(line):
+    """Format one stripped, non-empty body line."""
+    # Numbered items and plain text only need cleaning
+    if line[0].isdigit() and '. ' in line[:4]:
+        return clean_text(line)
+    if '•' in line or line.startswith('-'):
+        line = line.replace('-', '•')
+        return f"  • {clean_text(line.split('•', 1)[1])}"
+    return clean_text(line)
+
+
+class ResponseFormatter:
+    """Formats and truncates a reply in one pass, optionally as it streams.
+
+    The reply is processed in '\\n\\n'-separated sections. A short first line
+    of a section without list markers is kept as its own intro paragraph;
+    other lines become numbered items, "  • " bullets or cleaned text. If
+    the result is a list-type response, only the intro and the first
+    max_items list items are kept, with a note when items were dropped.
+    """
+
+    def __init__(self, max_items=5):
+        self.max_items = max_items
+        self.pending = ''
+        # Where to resume looking for a section break in pending
+        self._scan_from = 0
+        # Output lines, with '' between sections
+        self.lines = []
+        self.sections = 0
+        # Index of the blank line ending the intro, once known
+        self.intro_end = None
+        self.items = []
+        self.item_count = 0
+        self.list_mode = False
+
+    @property
+    def complete(self):
+        """True once truncation makes any further reply text irrelevant."""
+        return self.list_mode and self.item_count > self.max_items
+
+    def feed(self, chunk):
+        """Add streamed text and return the newly formatted sections."""
+        self.pending += chunk
+        formatted = []
+        while not self.complete:
+            end = self.pending.find('\n\n', self._scan_from)
+            if end < 0:
+                # A break may straddle this chunk and the next
+                self._scan_from = max(len(self.pending) - 1, 0)
+                break
+            section = self.pending[:end]
+            self.pending = self.pending[end + 2:]
+            self._scan_from = 0
+            formatted.extend(self._add_section(section))
+        return formatted
+
+    def finish(self):
+        """Flush the trailing section and return the final reply."""
+        if not self.complete:
+            self._add_section(self.pending)
+        self.pending = ''
+        self._scan_from = 0
+        return self.result()
+
+    def format(self, message):
+        """Format a complete reply."""
+        for section in message.split('\n\n'):
+            self._add_section(section)
+            if self.complete:
+                break
+        return self.result()
+
+    def result(self):
+        if not self.list_mode:
+            return '\n'.join(self.lines)
+        end = self.intro_end if self.intro_end is not None else len(self.lines)
+        result = ['\n'.join(self.lines[:end])]
+        if self.items:
+            result.append('\n'.join(self.items))
+        if self.item_count > len(self.items):
+            result.append(MORE_ITEMS_NOTE)
+        return '\n\n'.join(result)
+
+    def _add_section(self, section):
+        lines = section.split('\n')
+        first = lines[0]
+        body = []
+        intro = True
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if stripped and stripped[0].isdigit():
+                intro = False
+            if '•' in line:
+                intro = False
+            if i and stripped:
+                body.append(format_line(stripped))
+
+        parts = []
+        if intro and len(first.split()) < GREETING_MAX_WORDS:
+            parts.append(clean_text(first))
+        elif first.strip():
+            body.insert(0, format_line(first.strip()))
+        if body:
+            parts.append('\n'.join(body))
+
+        for part in parts:
+            if self.sections:
+                self._add_line('')
+            for line in part.split('\n'):
+                self._add_line(line)
+            self.sections += 1
+        return parts
+
+    def _add_line(self, line):
+        index = len(self.lines)
+        # Sections are split on the first '\n\n', i.e. a blank line between lines
+        if self.intro_end is None and index >= 2 and self.lines[-1] == '':
+            self.intro_end = index - 1
+        self.lines.append(line)
+
+        stripped = line.strip()
+        if stripped.startswith(LIST_START_PREFIXES):
+            self.list_mode = True
+        if self.intro_end is not None and stripped.startswith(LIST_ITEM_PREFIXES):
+            self.item_count += 1
+            if len(self.items) < self.max_items:
+                self.items.append(line)
+
+
+def postprocess_response(message, max_items=5):
+    """Format a model reply and truncate it if it is a list-type response."""
+    return ResponseFormatter(max_items=max_items).format(message)
+
+
+def extract_user_info(message):
+    """Extract potential user information from the message."""
+    info = {}
+    for pattern in NAME_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            info['name'] = match.group(1)
+            break
+    return info